@@ -0,0 +1,119 @@
+import cv2
+import sys
+import time
+import numpy as np
+
+import uc480
+
+
+# size of each camera's tile in the combined view, and tiles per row
+tileSize = (512,384)
+tileColumns = 2
+
+# show the tiled live view at all? (throughput numbers are printed either way)
+showView = '--headless' not in sys.argv
+
+# how often to print per-camera throughput, in seconds
+statsInterval = 5.0
+
+# run against simulated cameras instead (python MultiCam.py --sim)
+simulate = '--sim' in sys.argv
+
+
+def openCameras(ids):
+    '''Open and start each camera, each with its own buffers and acquisition thread'''
+    cameras = []
+    for id in ids:
+        camera = uc480.camera(id)
+        camera.AllocSequence(4)
+        camera.SetImageSize()
+        camera.SetColorMode()
+        camera.SetPixelClock(20)
+        camera.SetExposureTime(2)
+        camera.SetFrameRate(20)
+        camera.CaptureVideo()
+        camera.StartAcquisition()
+        print 'Opened camera %d' % camera.cameraId
+        cameras.append(camera)
+    return cameras
+
+def closeCameras(cameras):
+    for camera in cameras:
+        camera.StopAcquisition()
+        camera.StopLiveVideo()
+        camera.FreeImageMem()
+        camera.ExitCamera()
+
+def latestFrame(camera):
+    '''Newest frame in the camera's queue, dropping any older ones'''
+    frame = None
+    while len(camera.queue):
+        frame = camera.queue.get(0)
+    return frame
+
+def printStats(cameras):
+    for camera in cameras:
+        print 'camera %d: %d frames at %.1f fps, dropped %d, queue %d/%d' % \
+            (camera.cameraId, camera.framesRead, camera.GetThroughput(),
+             camera.dropped, len(camera.queue), camera.queue.size)
+
+def tileImage(tiles, images):
+    '''Draw each camera's latest image into its tile of the combined view'''
+    for i,img in enumerate(images):
+        if img is None:
+            continue
+        x = (i % tileColumns)*tileSize[0]
+        y = (i / tileColumns)*tileSize[1]
+        tiles[y:y+tileSize[1],x:x+tileSize[0]] = \
+                cv2.resize(img,tileSize,interpolation=cv2.INTER_AREA)
+
+
+if __name__ == '__main__':
+    ids = [int(a) for a in sys.argv[1:] if a.isdigit()]
+
+    if simulate:
+        import uc480_sim
+        uc480.SetBackend(uc480_sim.SimLibrary(cameras=max(len(ids),2)))
+
+    # no IDs given, so open everything that's plugged in
+    if not ids:
+        ids = [info.dwCameraID for info in uc480.GetCameraList()]
+    if not ids:
+        print 'No cameras found'
+        sys.exit(1)
+
+    cameras = openCameras(ids)
+
+    rows = (len(cameras)+tileColumns-1)/tileColumns
+    tiles = np.zeros((rows*tileSize[1],tileColumns*tileSize[0]),np.uint8)
+    images = [None]*len(cameras)
+
+    lastStats = time.time()
+    loop = True
+
+    # ctrl-c stops a headless run
+    try:
+        while(loop):
+            if showView:
+                for i,camera in enumerate(cameras):
+                    frame = latestFrame(camera)
+                    if frame is not None:
+                        images[i] = frame.image
+                tileImage(tiles, images)
+                cv2.imshow('MultiCam', tiles)
+                loop = cv2.waitKey(20) != 27
+            else:
+                # nobody looks at the frames, just keep the queues drained
+                for camera in cameras:
+                    latestFrame(camera)
+                time.sleep(0.05)
+
+            if time.time() - lastStats > statsInterval:
+                printStats(cameras)
+                lastStats = time.time()
+    except KeyboardInterrupt:
+        pass
+
+    printStats(cameras)
+    closeCameras(cameras)
+    cv2.destroyAllWindows()
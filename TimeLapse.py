@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import numpy as np
+
+import uc480
+import recorder
+import UberCam
+
+
+# python TimeLapse.py [interval] [frames] [points] [--sim]
+# one still every interval seconds, each the average of frames frames,
+# for points stills (0 = until ctrl-c)
+args = [float(a) for a in sys.argv[1:] if a.replace('.','',1).isdigit()]
+interval = args[0] if len(args) > 0 else 60.0
+framesPerPoint = int(args[1]) if len(args) > 1 else 1
+points = int(args[2]) if len(args) > 2 else 0
+
+# how often to print timing and cpu figures, in time points
+statsEvery = 10
+
+
+def cpuTime():
+    '''User plus system cpu seconds used by this process so far'''
+    t = os.times()
+    return t[0] + t[1]
+
+def grabAverage(camera, count):
+    '''Trigger count single frames and return their average, as uint8'''
+    total = None
+    n = 0
+    for i in range(count):
+        camera.FreezeVideo(uc480.IS_WAIT)
+        with camera.Image() as img:
+            if img is None:
+                continue
+            if total is None:
+                total = np.zeros(img.shape, np.uint32)
+            total += img
+            n += 1
+    if total is None:
+        return None
+    # rounded, not truncated
+    return ((total + n/2)/n).astype(np.uint8)
+
+def printStats(jitter, shots, cpu, wall):
+    late = np.abs(jitter)*1000
+    print '%d points: start jitter mean %.1f ms, max %.1f ms; ' \
+        'interval %.3f s +- %.1f ms; cpu %.2f%%' % \
+        (len(jitter), late.mean(), late.max(),
+         np.diff(shots).mean() if len(shots) > 1 else 0,
+         np.diff(shots).std()*1000 if len(shots) > 1 else 0,
+         100*cpu/max(wall, 1e-9))
+
+
+if __name__ == '__main__':
+    UberCam.showWindow = False
+    camera = UberCam.init()
+    # saveImage() files stills and catalogs them through these
+    UberCam.camera = camera
+    UberCam.zoom = 0
+    UberCam.stills = recorder.StillWriter(1)
+
+    # the sensor stays idle between time points
+    camera.StopLiveVideo()
+
+    print 'Time-lapse: every %g s, %d frame(s) each, %s points' % \
+        (interval, framesPerPoint, points or 'unlimited')
+
+    jitter = []
+    shots = []
+    start = time.time()
+    cpu = cpuTime()
+    k = 0
+
+    # ctrl-c ends the run
+    try:
+        while not points or k < points:
+            # due times come from the start, so lateness never adds up
+            due = start + k*interval
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            shot = time.time()
+            jitter.append(shot - due)
+            shots.append(shot)
+
+            img = grabAverage(camera, framesPerPoint)
+            if img is None:
+                print 'No frame at point %d' % k
+            else:
+                UberCam.saveImage(img)
+            k += 1
+
+            if k % statsEvery == 0:
+                printStats(np.array(jitter), np.array(shots), cpuTime() - cpu, time.time() - start)
+    except KeyboardInterrupt:
+        pass
+
+    if jitter:
+        printStats(np.array(jitter), np.array(shots), cpuTime() - cpu, time.time() - start)
+    UberCam.stills.stop()
+    camera.FreeImageMem()
+    camera.ExitCamera()
+    UberCam.catalog.close()
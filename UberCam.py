@@ -1,16 +1,23 @@
 import cv2
 import datetime
 import glob
+import os
+import sys
 import numpy as np
 import time
 import subprocess as sp
 import pdb
 
 import uc480
+import recorder
+import processing
+import catalog as capturecat
 
 
 imgDir = 'C:\\UberCam\\'
 imgIndex = 0
+# every capture gets recorded in here, in imgDir
+catalogName = 'catalog.db'
 
 # size of image region and overall window
 displaySize = (800,600)
@@ -19,20 +26,76 @@ windowSize = (800,700)
 # scaling of image, as per full camera resolution
 umPerPixel = 0.113*5
 
+# number of driver buffers in the capture ring (1 = single buffer, no ring)
+seqDepth = 4
+# read frames as views straight onto the driver buffers instead of copying
+zeroCopy = True
 
-ff_command = ['ffmpeg.exe',
-        '-y', # (optional) overwrite output file if it exists
-        '-f', 'rawvideo',
-        '-vcodec','rawvideo',
-        '-s', '1024x768', # size of one frame
-        '-pix_fmt', 'gray',
-        '-r', '20', # frames per second
-        '-an', # Tells FFMPEG not to expect any audio
-        '-i', '-', # The imput comes from a pipe        
-#        '-vcodec', 'libx264',
-        '-vcodec', 'mjpeg',
-        'my_output_videofile.avi']
+# acquire on a background thread, into a bounded queue the loop reads from
+threaded = True
+queueSize = 8
+queuePolicy = uc480.DROP_OLDEST
 
+# camera frame rate, and the rate to ask for when only the zoom box is read out
+frameRate = 20
+aoiFrameRate = 100
+# when zoomed, have the sensor read out only the zoom box (hardware AOI)
+hardwareAOI = False
+
+# record through ffmpeg ('avi'), or straight to disk as raw frames ('raw')
+# for full-rate capture; raw space is set aside for rawSeconds up front.
+# 'stack' is lossless too, compressed in chunks of stackChunk frames by a
+# pool of stackProcesses (None = one per core)
+recordFormat = 'avi'
+rawSeconds = 60
+stackChunk = 16
+stackCodec = 'zlib'
+stackProcesses = None
+# ffmpeg codec for 'avi' recordings: 'ffv1' or 'raw' (lossless), 'mjpeg' or
+# 'x264' (previews); x264's speed preset, and encoder threads (0 = auto)
+videoCodec = 'mjpeg'
+videoPreset = 'veryfast'
+videoThreads = 0
+
+# pre-trigger burst: the last burstPre seconds are always kept in RAM (at most
+# burstMemory bytes), and 'b' saves them plus the next burstPost seconds
+burstPre = 5
+burstPost = 5
+burstMemory = 512*2**20
+
+# stills: 'png' or 'tif' (lossless) or 'jpg', saved by stillThreads background
+# threads; 'k' saves a burst of stillBurst consecutive frames
+stillFormat = 'png'
+stillThreads = 2
+stillBurst = 10
+
+# open the live window in init() (TimeLapse.py runs without one)
+showWindow = True
+
+# dark and flat calibration, kept in calibDir by exposure and gain: 'd' and
+# 'w' capture a dark and a flat from the next calibFrames frames, 'c' turns
+# correction on and off
+calibDir = os.path.join(imgDir, 'calibration')
+calibFrames = 32
+
+# running average ('y'): true mean of the last avgCount frames ('window'), or
+# an exponential moving average weighting each new frame 1/avgCount ('ema')
+avgMode = 'window'
+
+# focus assist ('m'): a sharpness score of the zoom box every frame, graphed
+# with the best so far; 't' adds a score for each of focusTiles (rows,
+# columns) tiles over the image, to judge tilt by
+focusTiles = (3,4)
+
+# run against the simulated camera instead (python UberCam.py --sim)
+simulate = '--sim' in sys.argv
+# or play a recording back as the camera (python UberCam.py --play file.raw);
+# 'p' pauses, 'n' steps a frame, 'f' goes through playSpeeds (0 = as fast
+# as possible), 'j'/'l' skip back/forward by playSkip seconds
+playFile = sys.argv[sys.argv.index('--play')+1] if '--play' in sys.argv[:-1] else None
+playSpeeds = [1, 2, 0, 0.5]
+playSkip = 5.0
+player = None
 
 
 def imgRoot():
@@ -41,20 +104,38 @@ def imgRoot():
     return d.strftime("%Y-%m-%d")
 
 def init():
-    global imgIndex
+    global imgIndex, catalog, player
     
-    # figure out how many images we have already from today
-    files =	 glob.glob(imgDir + imgRoot() + '.*.???')
-    if files:
-        maxnum = max(map(lambda x: int((x.split('.'))[1]), files))
-        imgIndex = maxnum + 1
+    # capture numbers come from the catalog, so instances sharing imgDir
+    # never clash and we don't have to list the directory
+    catalog = capturecat.Catalog(imgDir + catalogName)
+    imgIndex = catalog.peekIndex(imgRoot())
+    if imgIndex is None:
+        # first run today with the catalog: carry on after any files already here
+        files =	 glob.glob(imgDir + imgRoot() + '.*.???')
+        imgIndex = 0
+        if files:
+            imgIndex = max(map(lambda x: int(os.path.basename(x).split('.')[1]), files)) + 1
+        catalog.seed(imgRoot(), imgIndex)
     
     print 'Starting file list at index ' + str(imgIndex)
     
+    if simulate:
+        import uc480_sim
+        uc480.SetBackend(uc480_sim.SimLibrary())
+    elif playFile is not None:
+        import uc480_play
+        library = uc480_play.PlayLibrary([playFile])
+        uc480.SetBackend(library)
+        player = library.cameras[0]
+    
     # create the ThorLabs camera
     camera = uc480.camera()
-    camera.AllocImageMem()
-    camera.SetImageMem()
+    if seqDepth > 1:
+        camera.AllocSequence(seqDepth)
+    else:
+        camera.AllocImageMem()
+        camera.SetImageMem()
     camera.SetImageSize()
     camera.SetColorMode()
     camera.SetPixelClock(20)
@@ -64,36 +145,165 @@ def init():
     if 0:
         camera.SetGain(1)
         camera.SetExposureTime(10)
-        camera.SetFrameRate(20)
+        camera.SetFrameRate(frameRate)
     else:
         camera.SetGain(1)
         camera.SetExposureTime(2)
-        camera.SetFrameRate(20)
+        camera.SetFrameRate(frameRate)
         #camera.SetGainBoost()
         
     camera.CaptureVideo()
     
-    cv2.namedWindow("UberCam", cv2.cv.CV_WINDOW_AUTOSIZE)
+    if showWindow:
+        cv2.namedWindow("UberCam", cv2.cv.CV_WINDOW_AUTOSIZE)
     
     return camera
     
     
-def saveImage(img):
-    global imgIndex
+def saveImage(img, fname=None):
+    '''Hand img to the still writer; it must not change afterwards. Can be
+    called from the acquisition thread: the catalog is only written to from
+    the still writer's, once the file is saved.'''
+    if fname is None:
+        fname = nextName() + '.' + stillFormat
+    settings = captureSettings()
+    stills.save(fname, img, lambda fname, ok: stillSaved(fname, ok, settings))
     
-    fname = '{}{}.{:03d}.jpg'.format(imgDir,imgRoot(),imgIndex)
-    cv2.imwrite(fname, img);
-    print 'Saved ' + fname
-    imgIndex = imgIndex + 1
+def stillSaved(fname, ok, settings):
+    # called from a still writer thread
+    global stillStatus
+    stillStatus = (('Saved ' if ok else 'Could not save ') + os.path.basename(fname), time.time())
+    print stillStatus[0]
+    if ok:
+        logCapture(fname, settings)
+        catalog.setSize(fname)
     
-def nextVideo():
+def startStillBurst():
+    '''Save the next stillBurst frames as <name>.000.png, <name>.001.png...'''
+    global stillBurstName, stillsLeft
+    stillBurstName = nextName()
+    stillsLeft = stillBurst
+    
+def burstStill(img):
+    '''Save img if a still burst is under way'''
+    global stillsLeft
+    if stillsLeft > 0:
+        saveImage(img, '{}.{:03d}.{}'.format(stillBurstName, stillBurst-stillsLeft, stillFormat))
+        stillsLeft = stillsLeft - 1
+    
+def nextName():
+    '''Next free file name, without the extension'''
     global imgIndex
     
-    fname = '{}{}.{:03d}.avi'.format(imgDir,imgRoot(),imgIndex)
-    imgIndex = imgIndex + 1
+    day = imgRoot()
+    index = catalog.nextIndex(day)
+    fname = '{}{}.{:03d}'.format(imgDir,day,index)
+    imgIndex = index + 1
+    
+    return fname
     
+def nextVideo(ext='avi'):
+    fname = nextName() + '.' + ext
+    logCapture(fname)
     return fname
     
+def captureSettings():
+    '''The settings a capture is being taken at, for the catalog'''
+    return dict(camera=camera.cameraId, width=camera.width, height=camera.height,
+                exposure=camera.exposure, gain=camera.gain, fps=camera.fps, zoom=zoom)
+    
+def logCapture(fname, settings=None):
+    '''Note a capture in the catalog, with the settings it's being (or was)
+    taken at'''
+    day,index = os.path.basename(fname).split('.')[:2]
+    catalog.add(fname, day, int(index), **(settings or captureSettings()))
+    
+def stopRecording():
+    '''Finish the recording under way and note its size in the catalog'''
+    global video
+    if rawListener in camera.listeners:
+        camera.listeners.remove(rawListener)
+    video.stop()
+    meta.stop()
+    catalog.setSize(video.fname)
+    print 'Stopped recording: ' + video.status()
+    video = None
+    
+def recordFrame(video, meta, img, frame, time):
+    '''Hand a frame to the recorder, and log the settings it was taken and
+    shown with'''
+    video.write(img, frame, time, camera.exposure, camera.gain)
+    meta.write(frame, time, camera.gain, camera.exposure, zoom, doAverage)
+    
+def calibrateStage(f):
+    '''Feed raw frames to a calibration capture, and correct them'''
+    calibration.select(camera.exposure, camera.gain)
+    if calibration.capturing:
+        kind = calibration.capturing
+        if calibration.feed(f.image):
+            print 'Saved %s frame for exposure %s ms, gain %d' % ((kind,) + calibration.key)
+    if correct and calibration.active:
+        f.image = calibration.apply(f.image, f.origin)
+        f.reused = True
+    
+def averageStage(f):
+    averager.add(f.image)
+    f.image = averager.frame()
+    f.reused = True
+    
+def recordStage(f):
+    # the recorder keeps a reference, so buffers that get written
+    # again (driver's, average, correction) need copying
+    recordFrame(video, meta, f.image.copy() if f.reused else f.image, f.number, f.time)
+    
+def cropStage(f):
+    '''The part on show: full frames get cropped to the zoom box, hardware
+    AOI frames already are'''
+    f.full = f.image.shape == (height,width)
+    f.view = subImage(f.image,zoomOrigin,zoomBox) if f.full else f.image
+    
+def measureStage(f):
+    focus.measure(f.view, focusHeat)
+    
+def toneStage(f):
+    f.view = tone.apply(f.view)
+    
+def displayStage(f):
+    # clear the status strip; the image part gets drawn over anyway
+    windowImage[displaySize[1]:].fill(0)
+    
+    # scale from full image to display size, straight into the window
+    cv2.resize(f.view,displaySize,dst=displayView)
+            
+    # should we draw the zoombox sub-window?
+    if subView and (zoom > 0) and f.full:
+        cv2.resize(f.image,subSize,dst=insetImage,interpolation=cv2.cv.CV_INTER_AREA)
+        cv2.LUT(insetImage,tone.table(),dst=insetView)
+        cv2.rectangle(windowImage,subPos,(subPos[0]+subSize[0],subPos[1]+subSize[1]),(255,255,255))
+    
+    drawScaleBar(windowImage)
+    if focusAssist:
+        drawFocus(windowImage)
+        if focusHeat:
+            drawFocusHeat(windowImage)
+    
+    if video is not None:
+        leftText(windowImage, 'REC ' + video.status(), (10, displaySize[1]+40))
+    if burst.busy:
+        leftText(windowImage, 'BURST ' + burst.status(), (10, displaySize[1]+60))
+    if not tone.identity:
+        leftText(windowImage, 'TONE ' + tone.status(), (300, displaySize[1]+20))
+    if calibration.capturing:
+        leftText(windowImage, 'CAL %s %d/%d' % (calibration.capturing, calibration.n, calibration.wanted),
+                 (10, displaySize[1]+60))
+    if stillStatus is not None and time.time() - stillStatus[1] < 3:
+        leftText(windowImage, stillStatus[0], (10, displaySize[1]+80))
+    if player is not None:
+        leftText(windowImage, 'PLAY ' + player.Status(), (10, displaySize[1]+20))
+    
+    # display the image
+    cv2.imshow("UberCam", windowImage)
+    
 def cvPt(pt):
     '''Format a point in OpenCV-appropriate int-tuple'''
     return tuple(map(int,pt))
@@ -127,6 +337,35 @@ def drawScaleBar(img):
     ums = umPerPixel * 200 / 2**zoom
     centeredText(img, '{:3.1f} um'.format(ums), tuple(ds+np.array([-150, 40])))
 
+def drawFocus(img):
+    '''Draw the focus score graph below the image, left of the scale bar,
+    with a line at the best score so far'''
+    x0,y0,w,h = 300,displaySize[1]+30,220,45
+    cv2.rectangle(img, (x0,y0), (x0+w,y0+h), (128,128,128))
+    top = 1.1*focus.peak or 1.0
+    scores = focus.history()
+    if len(scores) > 1:
+        xs = x0 + np.arange(len(scores))*w/(len(focus.scores)-1)
+        ys = y0+h - scores*h/top
+        cv2.polylines(img, [np.int32(np.column_stack((xs,ys)))], False, (255,255,255))
+    # peak hold
+    py = int(y0+h - focus.peak*h/top)
+    cv2.line(img, (x0-6,py), (x0+w,py), (160,160,160))
+    leftText(img, 'FOCUS %.0f peak %.0f' % (focus.score, focus.peak), (x0, y0+h+18), fontScale=0.4)
+
+def drawFocusHeat(img):
+    '''Draw each tile's focus score over the image, as a percentage of the
+    sharpest tile's'''
+    if focus.heat is None:
+        return
+    rows,cols = focus.heat.shape
+    tw,th = displaySize[0]/cols,displaySize[1]/rows
+    best = focus.heat.max() or 1.0
+    for i in range(rows):
+        for j in range(cols):
+            cv2.rectangle(img, (j*tw,i*th), ((j+1)*tw,(i+1)*th), (128,128,128))
+            centeredText(img, '%d%%' % (100*focus.heat[i,j]/best), (j*tw+tw/2,i*th+th/2))
+
 
 if __name__ == '__main__':
     # main doesn't need global decls since this isn't a function!
@@ -154,17 +393,57 @@ if __name__ == '__main__':
     doAverage = False
     # how many frames to store
     avgCount = 10
-    # which index are we on in rotating buffer?
-    avgIndex = 0
-    # current image
-    avgFrame = np.zeros((height,width),np.uint8)
-    newAvgFrame = np.zeros((height,width),np.uint8)
+    # only fed while averaging is on; it restarts by itself if the frame
+    # size changes (hardware AOI)
+    averager = processing.Averager(avgCount, avgMode)
+    
+    # dark/flat correction
+    calibration = processing.Calibration(calibDir, (height,width))
+    correct = False
+    
+    # display-only tone curve, on what's shown rather than the whole frame
+    tone = processing.ToneMap()
+    
+    # focus assist, off until 'm'
+    focus = processing.FocusMeter(tiles=focusTiles)
+    focusAssist = False
+    focusHeat = False
+    
+    # what happens to each frame, in order; stages only run when something
+    # uses what they make ('i' prints how long each takes)
+    pipeline = processing.Pipeline()
+    pipeline.add('calibrate', calibrateStage, lambda: correct or calibration.capturing)
+    pipeline.add('average', averageStage, lambda: doAverage)
+    pipeline.add('record', recordStage, lambda: video is not None and rawListener not in camera.listeners)
+    pipeline.add('crop', cropStage)
+    pipeline.add('measure', measureStage, lambda: focusAssist)
+    pipeline.add('tone', toneStage, lambda: tone.auto or not tone.identity)
+    pipeline.add('display', displayStage)
 
     # variable for recording video    
     video = None
+    # raw recording hook on the acquisition thread, when there is one
+    rawListener = None
+    # per-frame settings, logged beside the recording
+    meta = None
+    # background still saving, and what it last did for the status line
+    stills = recorder.StillWriter(stillThreads)
+    stillStatus = None
+    # still burst under way: its file name and how many frames are left
+    stillBurstName = None
+    stillsLeft = 0
+    stillListener = lambda f: burstStill(f.image)
+    
+    # RAM ring for pre-trigger bursts, of full frames only
+    burst = recorder.BurstRecorder(width, height, camera.fps, burstPre, burstPost, burstMemory)
+    burstListener = lambda f: burst.write(f.image, f.number, f.time, camera.exposure, camera.gain)
     
     # and create an image to draw to screen
     windowImage = np.zeros(windowSize[::-1],np.uint8)
+    # where displayStage draws into it, and the inset before its tone curve
+    displayView = windowImage[0:displaySize[1],0:displaySize[0]]
+    insetView = windowImage[subPos[1]:subPos[1]+subSize[1],subPos[0]:subPos[0]+subSize[0]]
+    insetImage = np.zeros(subSize[::-1],np.uint8)
     
     # create the window and set mouse callback
     # pass target image list as special param so we can write it
@@ -172,17 +451,46 @@ if __name__ == '__main__':
     
     loop = True
     
-    lastFrameNum = -1
+    if threaded:
+        # the burst ring is fed from the acquisition thread, so it gets every frame
+        camera.listeners.append(burstListener)
+        # still bursts too, so they really are consecutive frames
+        camera.listeners.append(stillListener)
+        camera.StartAcquisition(queueSize, queuePolicy)
+    else:
+        # block on the driver's frame event rather than polling the frame count
+        camera.InitEvent()
     
     while(loop):
-        while camera.GetFrameCount() == lastFrameNum:
-            pass
-        lastFrameNum = camera.GetFrameCount()
-        time.sleep(0.010)
-        
-        # get next frame (by ref...)
-        camera.CopyImageMem()
-        curimg = camera.data
+        if threaded:
+            frame = camera.queue.get(1.0)
+            if frame is None:
+                print 'Timed out waiting for frame'
+                continue
+            curimg = frame.image
+            curFrame,curTime = frame.number,frame.time
+            # a copy of its own, nothing else writes to it
+            reused = False
+        else:
+            if not camera.WaitForNextFrame(1000):
+                print 'Timed out waiting for frame'
+                continue
+            
+            # get next frame (by ref...)
+            if zeroCopy:
+                curimg = camera.LockImage()
+                if curimg is None:
+                    continue
+            else:
+                camera.CopyImageMem()
+                curimg = camera.data
+            curFrame,curTime = camera.frame,camera.deviceTime
+            # the ring copies the frame, so a driver view is fine here
+            burst.write(curimg, curFrame, curTime, camera.exposure, camera.gain)
+            if stillsLeft > 0:
+                burstStill(curimg.copy())
+            # a driver buffer or camera.data, both get written again
+            reused = True
         
         # calculate source box from captured image, based on current zoom value
         zoomBox = (width/(2**zoom),height/(2**zoom))
@@ -195,35 +503,15 @@ if __name__ == '__main__':
         zoomOrigin = (zoomx-zoomBox[0]/2,zoomy-zoomBox[1]/2)
         
                 
-        # always have average running
-        newAvgFrame = newAvgFrame + (curimg/float(avgCount))
-        avgIndex = (avgIndex+1) % avgCount
-        if (avgIndex == 0):
-            # got through an entire cycle, update avg frame
-            avgFrame = newAvgFrame.copy()
-            newAvgFrame.fill(0)
-
-        # but only display when we gotsa
-        if (doAverage):
-            curimg = avgFrame
-
-        # clear the window
-        windowImage.fill(0)
-        
-        # scale from full image to display size, and draw to window
-        windowImage[0:displaySize[1],0:displaySize[0]] = \
-                cv2.resize(subImage(curimg,zoomOrigin,zoomBox),displaySize)
-                
-        # should we draw the zoombox sub-window?
-        if subView and (zoom > 0):
-            windowImage[subPos[1]:subPos[1]+subSize[1],subPos[0]:subPos[0]+subSize[0]] = \
-                    cv2.resize(curimg,subSize,interpolation=cv2.cv.CV_INTER_AREA)
-            cv2.rectangle(windowImage,subPos,(subPos[0]+subSize[0],subPos[1]+subSize[1]),(255,255,255))
-        
-        drawScaleBar(windowImage)
+        # everything that happens to a frame before it's shown
+        origin = (0,0) if curimg.shape == (height,width) else camera.aoi[0]
+        work = pipeline.run(processing.Work(curimg, curFrame, curTime, origin, reused))
+        curimg,reused = work.image,work.reused
         
-        # display the image
-        cv2.imshow("UberCam", windowImage)
+        # raw recordings only have the room set aside when they started
+        if isinstance(video, recorder.RawRecorder) and video.full:
+            print 'Raw recording is full (%d s)' % rawSeconds
+            stopRecording()
         
         # get any keypresses
         char = cv2.waitKey(10)
@@ -236,7 +524,29 @@ if __name__ == '__main__':
         if (char == 27):
             loop = False
         if (char == ord(' ')):
-            saveImage(curimg)
+            # the still writer keeps a reference, like the recorder below
+            saveImage(curimg.copy() if reused else curimg)
+        if (char == ord('K') or char == ord('k')):
+            startStillBurst()
+        if (char == ord('I') or char == ord('i')):
+            print pipeline.report()
+            
+        # playback controls
+        if player is not None:
+            if (char == ord('p')):
+                if player.paused:
+                    player.Play()
+                else:
+                    player.Pause()
+            if (char == ord('n')):
+                player.Step()
+            if (char == ord('f')):
+                speed = playSpeeds[(playSpeeds.index(player.speed)+1) % len(playSpeeds)] \
+                    if player.speed in playSpeeds else playSpeeds[0]
+                player.SetSpeed(speed)
+            if (char == ord('j') or char == ord('l')):
+                now = player.source.times[max(player.position,0)]
+                player.SeekTime(now + (playSkip if char == ord('l') else -playSkip))
         # zoom in and out
         if (char == ord('=') or char == ord('+')):
             zoom = min(zoom+1,4)
@@ -255,6 +565,34 @@ if __name__ == '__main__':
             camera.SetGain(gain)
         if (char == ord('a')):
             camera.SetGain()
+            
+        # display tone: software gain, gamma, contrast, auto-stretch, reset
+        # (only changes what's shown, not the frames saved or recorded)
+        if (char == ord(']')):
+            tone.gain = min(tone.gain*1.25,16)
+        if (char == ord('[')):
+            tone.gain = max(tone.gain/1.25,1/16.0)
+        if (char == ord('}')):
+            tone.gamma = min(tone.gamma*1.1,4)
+        if (char == ord('{')):
+            tone.gamma = max(tone.gamma/1.1,0.25)
+        if (char == ord('>')):
+            tone.contrast = min(tone.contrast*1.1,4)
+        if (char == ord('<')):
+            tone.contrast = max(tone.contrast/1.1,0.25)
+        if (char == ord('h')):
+            tone.auto = not tone.auto
+            if not tone.auto:
+                tone.black,tone.white = 0,255
+        if (char == ord('o')):
+            tone.reset()
+        
+        # focus assist, with the peak starting over each time it's turned on
+        if (char == ord('M') or char == ord('m')):
+            focusAssist = not focusAssist
+            focus.reset()
+        if (char == ord('T') or char == ord('t')):
+            focusHeat = not focusHeat
         
         # move zoom window around
         # don't ask me where the arrow key codes come from.... 0_o
@@ -270,50 +608,106 @@ if __name__ == '__main__':
         # toggle recording
         if (char == ord('R') or char == ord('r')):
             if video is None:
-                ff_command[-1] = nextVideo()
-                #ff_command[-2] = ff_command[-1] + '.raw'
-                video = sp.Popen(ff_command, stdin=sp.PIPE, stdout=open('foo.txt','w'), stderr=open('foe.txt','w'))
-                #video = open(ff_command[-2],'wb')
-                print 'Started recording at %d fps' % int(camera.fps)
-                #video = cv2.VideoWriter(nextVideo(), -1, int(camera.fps), (width, height))
-                #if not video.isOpened():
-                #    print 'Failed to open video stream!'
+                # full frames while recording, so size the recording for them now
+                if hardwareAOI and camera.SetAOI():
+                    camera.SetFrameRate(frameRate)
+                if recordFormat in ('raw', 'stack'):
+                    if recordFormat == 'raw':
+                        video = recorder.RawRecorder(nextVideo('raw'), width, height, int(rawSeconds*max(camera.fps,1)))
+                    else:
+                        video = recorder.StackWriter(nextVideo('ucs'), width, height, stackChunk, stackCodec,
+                                                     processes=stackProcesses)
+                    meta = recorder.MetadataWriter(video.fname + '.meta')
+                    if threaded:
+                        # fed from the acquisition thread, so it sees every frame
+                        rawListener = lambda f, video=video, meta=meta: \
+                            recordFrame(video, meta, f.image, f.number, f.time)
+                        camera.listeners.append(rawListener)
+                else:
+                    # at the rate the sensor actually runs, not the one we asked for;
+                    # ffmpeg gets fed from the recorder's own thread
+                    video = recorder.Recorder(nextVideo(recorder.CODECS[videoCodec][1]),
+                        camera.width, camera.height, camera.GetSensorRate(),
+                        videoCodec, camera.colorMode, videoPreset, videoThreads,
+                        stdout=open('foo.txt','w'), stderr=open('foe.txt','w'))
+                    meta = recorder.MetadataWriter(video.fname + '.meta')
+                print 'Started recording at %.1f fps' % camera.GetSensorRate()
             else:
-                #video.release()
-                video.stdin.close()
-                if video.stderr is not None:
-                    video.stderr.close()
-                video.wait()
-#                video.close()
-                video = None
-                print 'Stopped recording'
+                stopRecording()
+
+        # save the burst ring and what comes next
+        if (char == ord('B') or char == ord('b')):
+            # only this thread triggers, so a burst that isn't busy here
+            # takes the name; rejected presses don't use up a number
+            if burst.busy:
+                print 'Still saving the last burst'
+            else:
+                # the ring only takes full frames, so read those out until it's saved
+                if hardwareAOI and camera.SetAOI():
+                    camera.SetFrameRate(frameRate)
+                burst.trigger(nextVideo('raw'), catalog.setSize)
+                print 'Saving burst from %d frames back' % min(burst.count - burst.valid, burst.pre)
 
-        # save image
-        if video is not None:
-            #video.write(curimg)
-            #pdb.set_trace()
-            #video.communicate(curimg.tostring())
-            video.stdin.write( curimg.tostring() )
-#            video.stdin.flush()
-            #print video.stderr.read()
-#            video.write( curimg.tostring() )
-            
+        
+        # calibration capture, and correction on/off
+        if (char == ord('D') or char == ord('d')):
+            calibration.startCapture('dark', calibFrames)
+            print 'Capturing dark frame, keep the light out'
+        if (char == ord('W') or char == ord('w')):
+            calibration.startCapture('flat', calibFrames)
+            print 'Capturing flat frame, image something uniform'
+        if (char == ord('C') or char == ord('c')):
+            correct = not correct
+            print 'Correction ' + ('on' if correct else 'off')
         
         # toggle running average mode
         if (char == ord('Y') or char == ord('y')):
             doAverage = not doAverage
             if (doAverage):
-                # we just started averaging, set array to current frame
-                avgIndex = 0
-                avgFrame = curimg.copy()
-                newAvgFrame = curimg.copy()
-                newAvgFrame.fill(0)
+                # we just started averaging, from the current frame on
+                averager.reset()
+
+        # done with this frame, give the buffer back to the driver
+        if zeroCopy and not threaded:
+            camera.UnlockImage()
+        
+        # in hardware AOI mode, read out just the zoom box from the sensor
+        # (full frames while recording or saving a burst, so the size doesn't
+        # change, and while capturing calibration frames, which cover the sensor)
+        if hardwareAOI:
+            if zoom > 0 and video is None and not burst.busy and not calibration.capturing:
+                moved = camera.SetAOI(zoomOrigin[0],zoomOrigin[1],zoomBox[0],zoomBox[1])
+            else:
+                moved = camera.SetAOI()
+            if moved:
+                camera.SetFrameRate(aoiFrameRate if camera.aoi[1] != (width,height) else frameRate)
                             
     
     if video is not None:
-        video.terminate()
+        stopRecording()
         
+    if threaded:
+        camera.StopAcquisition()
+        camera.listeners.remove(burstListener)
+        camera.listeners.remove(stillListener)
+        print 'Frame queue: %(puts)d in, %(dropped)d dropped, ' \
+            'mean depth %(meanDepth).1f, max %(maxDepth)d' % camera.queue.stats()
+    else:
+        camera.ExitEvent()
     camera.StopLiveVideo()
+    if burst.busy:
+        burst.stop()
+        print 'Saved burst to %s: %d frames' % (burst.fname, burst.saved)
+    stills.stop()
+    print pipeline.report()
+    if calibration.applied:
+        print 'Correction: %.2f ms/frame (budget %.1f ms)' % \
+            (calibration.cost(), processing.CALIBRATION_BUDGET_MS)
+    print 'Read %d frames at %.1f fps, dropped %d' % \
+        (camera.framesRead, camera.GetThroughput(), camera.dropped)
+    if camera.seq:
+        print 'Buffer overruns: %d' % camera.overruns
     camera.FreeImageMem()
     camera.ExitCamera()
+    catalog.close()
     cv2.destroyAllWindows()
\ No newline at end of file
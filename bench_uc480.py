@@ -0,0 +1,225 @@
+'''Benchmarks for the uc480 wrapper, without the camera.
+
+    python bench_uc480.py call [path-to-stand-in-library]
+    python bench_uc480.py sim [fps] [seconds]
+    python bench_uc480.py import
+    python bench_uc480.py average [count]
+    python bench_uc480.py calibrate
+    python bench_uc480.py focus
+
+"call" times driver call overhead against a stand-in library. Without a path
+one is compiled with the system C compiler: every is_* function we bind just
+returns 0, so what's left is our own overhead.
+
+"sim" load-tests acquisition against the simulated camera (uc480_sim).
+
+"import" checks that importing uc480 stays under IMPORT_TARGET_MS on top of
+numpy, which it needs anyway.
+
+"average" times UberCam's running average per 1024x768 frame, the old float
+version against processing.Averager.
+
+"calibrate" checks dark and flat correction of a 1024x768 frame against
+processing.CALIBRATION_BUDGET_MS.
+
+"focus" checks the focus score, with tiles, of the zoom box at each zoom
+against processing.FOCUS_BUDGET_MS.
+'''
+
+import os
+import sys
+import ctypes
+import subprocess as sp
+import tempfile
+import timeit
+
+STANDIN_SRC = 'int is_%s() { return 0; }\n'
+IMPORT_TARGET_MS = 5.0
+
+
+def buildStandIn(names):
+    '''Compile a shared library exporting is_<name> for every name'''
+    d = tempfile.mkdtemp()
+    src = os.path.join(d, 'standin.c')
+    lib = os.path.join(d, 'standin.so')
+    f = open(src, 'w')
+    for name in names:
+        f.write(STANDIN_SRC % name)
+    f.close()
+    sp.check_call(['cc', '-shared', '-fPIC', '-o', lib, src])
+    return lib
+
+
+def benchCall(number=200000):
+    '''Per-call overhead of uc480.CALL, old getattr dispatch vs bound functions'''
+    import uc480
+    uc480.LoadLibrary()
+
+    # the dispatch CALL used to do on every call, against an untyped handle
+    rawlib = ctypes.cdll.LoadLibrary(os.environ['UC480_LIBRARY'])
+
+    def oldCALL(name, *args):
+        funcname = 'is_' + name
+        if (uc480.verbose):
+            print name
+        func = getattr(rawlib, funcname)
+        new_args = []
+        for a in args:
+            if isinstance(a, unicode):
+                new_args.append(str(a))
+            else:
+                new_args.append(a)
+        r = func(*new_args)
+        if (uc480.verbose):
+            print r
+        return r
+
+    cam = uc480.HCAM(1)
+    info = uc480.UC480_IMAGE_INFO()
+    id = ctypes.c_int(1)
+    size = ctypes.sizeof(info)
+
+    for label, call in [('old', oldCALL), ('new', uc480.CALL)]:
+        t = min(timeit.repeat(
+            lambda: call('GetImageInfo', cam, id, ctypes.byref(info), size),
+            number=number, repeat=3))
+        print '%s CALL: %.2f us/call' % (label, 1e6*t/number)
+
+
+def benchSim(fps=200, seconds=5.0):
+    '''Acquisition throughput through the background thread and frame queue'''
+    import time
+    import uc480
+    import uc480_sim
+
+    uc480.SetBackend(uc480_sim.SimLibrary(fps=fps))
+    camera = uc480.camera()
+    camera.AllocSequence(4)
+    camera.SetFrameRate(fps)
+    camera.CaptureVideo()
+    camera.StartAcquisition()
+
+    start = time.time()
+    cpu = time.clock()
+    while time.time() - start < seconds:
+        camera.queue.get(1.0)
+    cpu = time.clock() - cpu
+
+    camera.StopAcquisition()
+    camera.StopLiveVideo()
+    print 'sim at %d fps: read %d frames at %.1f fps, dropped %d, overruns %d' % \
+        (fps, camera.framesRead, camera.GetThroughput(), camera.dropped, camera.overruns)
+    print 'cpu: %.0f%% of one core' % (100*cpu/seconds)
+    camera.FreeImageMem()
+    camera.ExitCamera()
+
+
+def benchImport(repeat=10):
+    '''Time to import uc480 in a fresh interpreter, not counting numpy'''
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = ('import time; import numpy; t = time.time(); import uc480; '
+            'print (time.time() - t)*1000')
+    times = [float(sp.check_output([sys.executable, '-c', code], cwd=here))
+             for i in range(repeat)]
+    t = min(times)
+    print 'import uc480: %.2f ms (target %.1f ms) %s' % \
+        (t, IMPORT_TARGET_MS, 'ok' if t < IMPORT_TARGET_MS else 'SLOW')
+
+
+def benchAverage(count=10, frames=200):
+    '''Per-frame cost of the running average, old float code vs Averager'''
+    import numpy as np
+    import processing
+
+    rng = np.random.RandomState(0)
+    images = rng.randint(0, 256, (16, 768, 1024)).astype(np.uint8)
+
+    def old():
+        # what UberCam's loop did on every frame, averaging shown or not
+        avgIndex = 0
+        avgFrame = np.zeros((768, 1024), np.uint8)
+        newAvgFrame = np.zeros((768, 1024), np.uint8)
+        for i in xrange(frames):
+            curimg = images[i % len(images)]
+            newAvgFrame = newAvgFrame + (curimg/float(count))
+            avgIndex = (avgIndex+1) % count
+            if (avgIndex == 0):
+                avgFrame = newAvgFrame.copy()
+                newAvgFrame.fill(0)
+
+    def new(mode):
+        averager = processing.Averager(count, mode)
+        for i in xrange(frames):
+            averager.add(images[i % len(images)])
+            averager.frame()
+
+    for label, run in [('old float', old), ('window', lambda: new('window')),
+                       ('ema', lambda: new('ema'))]:
+        t = min(timeit.repeat(run, number=1, repeat=3))
+        print '%s: %.2f ms/frame' % (label, 1e3*t/frames)
+
+
+def benchCalibrate(frames=200):
+    '''Per-frame cost of dark and flat correction, against the budget'''
+    import shutil
+    import numpy as np
+    import processing
+
+    rng = np.random.RandomState(0)
+    images = rng.randint(0, 256, (16, 768, 1024)).astype(np.uint8)
+    d = tempfile.mkdtemp()
+    calibration = processing.Calibration(d)
+    calibration.select(2.0, 1)
+    for kind, level in [('dark', 8), ('flat', 180)]:
+        calibration.startCapture(kind, 4)
+        for i in range(4):
+            calibration.feed(rng.randint(level-5, level+5, (768, 1024)).astype(np.uint8))
+    shutil.rmtree(d)
+
+    def run():
+        for i in xrange(frames):
+            calibration.apply(images[i % len(images)])
+    t = 1e3*min(timeit.repeat(run, number=1, repeat=3))/frames
+    budget = processing.CALIBRATION_BUDGET_MS
+    print 'dark + flat: %.2f ms/frame (budget %.1f ms) %s' % (t, budget, 'ok' if t < budget else 'SLOW')
+
+
+def benchFocus(frames=200):
+    '''Per-frame cost of the focus score at each zoom, against the budget'''
+    import numpy as np
+    import processing
+
+    rng = np.random.RandomState(0)
+    images = rng.randint(0, 256, (16, 768, 1024)).astype(np.uint8)
+    meter = processing.FocusMeter()
+    budget = processing.FOCUS_BUDGET_MS
+    for zoom in range(4):
+        h, w = 768 >> zoom, 1024 >> zoom
+        def run():
+            for i in xrange(frames):
+                meter.measure(images[i % len(images), :h, :w], True)
+        t = 1e3*min(timeit.repeat(run, number=1, repeat=3))/frames
+        print 'focus %4dx%-3d (step %d): %.2f ms/frame (budget %.1f ms) %s' % \
+            (w, h, meter.step((h, w)), t, budget, 'ok' if t < budget else 'SLOW')
+
+
+if __name__ == '__main__':
+    which = sys.argv[1] if len(sys.argv) > 1 else 'call'
+    args = sys.argv[2:]
+    if which == 'call':
+        if args:
+            os.environ['UC480_LIBRARY'] = args[0]
+        elif 'UC480_LIBRARY' not in os.environ:
+            import uc480
+            os.environ['UC480_LIBRARY'] = buildStandIn(uc480.PROTOTYPES)
+        benchCall()
+    elif which == 'sim':
+        benchSim(*map(float, args))
+    elif which == 'import':
+        benchImport()
+    elif which == 'average':
+        benchAverage(*map(int, args))
+    elif which == 'calibrate':
+        benchCalibrate()
+    elif which == 'focus':
+        benchFocus()
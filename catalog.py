@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+
+SCHEMA = '''
+create table if not exists counters (
+    day text primary key,
+    next integer not null
+);
+create table if not exists captures (
+    id integer primary key,
+    fname text not null,
+    day text not null,
+    idx integer,
+    kind text,
+    created real not null,
+    camera integer,
+    width integer,
+    height integer,
+    exposure real,
+    gain integer,
+    fps real,
+    zoom integer,
+    size integer
+);
+create index if not exists captures_day on captures (day, idx);
+create index if not exists captures_created on captures (created);
+create index if not exists captures_settings on captures (exposure, gain);
+create index if not exists captures_fname on captures (fname);
+'''
+
+# capture columns that can be set by add() and matched by find()
+SETTINGS = ('camera', 'width', 'height', 'exposure', 'gain', 'fps', 'zoom')
+
+
+class Catalog(object):
+    '''Record of every capture, in a small SQLite database next to them.
+
+    Capture numbers are handed out by nextIndex(), one counter per day, in
+    a transaction: several UberCams sharing a directory never get the same
+    number. Can be used from any thread.
+    '''
+    def __init__(self, path):
+        self.path = path
+        # autocommit; nextIndex() does its own transaction
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def nextIndex(self, day):
+        '''Allocate the next capture number for day'''
+        with self.lock:
+            # takes the write lock up front, so nobody reads the same value
+            self.db.execute('begin immediate')
+            try:
+                row = self.db.execute('select next from counters where day = ?', (day,)).fetchone()
+                index = row[0] if row else 0
+                self.db.execute('insert or replace into counters (day, next) values (?, ?)', (day, index+1))
+            except:
+                self.db.execute('rollback')
+                raise
+            self.db.execute('commit')
+        return index
+
+    def peekIndex(self, day):
+        '''The number nextIndex() would give, or None if day has no counter yet'''
+        with self.lock:
+            row = self.db.execute('select next from counters where day = ?', (day,)).fetchone()
+        return row[0] if row else None
+
+    def seed(self, day, index):
+        '''Start day's counter at index, unless it already has one'''
+        with self.lock:
+            self.db.execute('insert or ignore into counters (day, next) values (?, ?)', (day, index))
+
+    def add(self, fname, day, index=None, **settings):
+        '''Record a capture; settings are any of SETTINGS. Returns its id.'''
+        for key in settings:
+            if key not in SETTINGS:
+                raise KeyError('unknown capture setting %s' % key)
+        columns = ['fname', 'day', 'idx', 'kind', 'created'] + settings.keys()
+        values = [fname, day, index, os.path.splitext(fname)[1].lstrip('.'), time.time()] + settings.values()
+        with self.lock:
+            cursor = self.db.execute('insert into captures (%s) values (%s)' %
+                                     (', '.join(columns), ', '.join('?'*len(columns))), values)
+        return cursor.lastrowid
+
+    def setSize(self, fname, size=None):
+        '''Fill in the size of a finished capture, from the file if not given'''
+        if size is None:
+            if not os.path.exists(fname):
+                return
+            size = os.path.getsize(fname)
+        with self.lock:
+            self.db.execute('update captures set size = ? where fname = ?', (size, fname))
+
+    def find(self, day=None, since=None, until=None, kind=None, **settings):
+        '''Captures matching all of the given day, creation time range (as
+        time.time() values), kind (file extension) and settings, oldest first'''
+        where = []
+        values = []
+        for column, op, value in [('day', '=', day), ('created', '>=', since),
+                                  ('created', '<', until), ('kind', '=', kind)]:
+            if value is not None:
+                where.append('%s %s ?' % (column, op))
+                values.append(value)
+        for key, value in settings.items():
+            if key not in SETTINGS:
+                raise KeyError('unknown capture setting %s' % key)
+            where.append('%s = ?' % key)
+            values.append(value)
+        query = 'select * from captures'
+        if where:
+            query += ' where ' + ' and '.join(where)
+        with self.lock:
+            return self.db.execute(query + ' order by created', values).fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+if __name__ == '__main__':
+    # python catalog.py catalog.db [day]
+    catalog = Catalog(sys.argv[1])
+    for row in catalog.find(*sys.argv[2:3]):
+        print '%s  %s  exp %s gain %s fps %s zoom %s  %s bytes' % \
+            (time.strftime('%H:%M:%S', time.localtime(row['created'])), row['fname'],
+             row['exposure'], row['gain'], row['fps'], row['zoom'], row['size'])
@@ -0,0 +1,461 @@
+import os
+import time
+from timeit import default_timer as timer
+import numpy as np
+
+
+class Averager(object):
+    '''Running average of the incoming 8-bit frames, done in integers and in
+    place, with all buffers allocated when the frame size is first seen.
+
+    mode 'window': true mean of the last count frames, from a ring of those
+    frames and a uint32 running sum (add the new one, take off the oldest).
+    mode 'ema': exponential moving average with weight 1/count for the new
+    frame, kept as 8.8 fixed point in uint16. The old average's share is
+    taken off its integer part, which keeps every step inside 16 bits; the
+    result settles on a steady image exactly, and is within a count of the
+    float EMA otherwise.
+
+    frame() works out the uint8 average only when asked for it, into the
+    same buffer every time: copy it if you keep it past the next add().
+    '''
+    def __init__(self, count=10, mode='window'):
+        if mode not in ('window', 'ema'):
+            raise ValueError('unknown averaging mode %s' % mode)
+        self.count = count
+        self.mode = mode
+        self.shape = None
+
+    def reset(self, shape=None):
+        '''Start over; buffers are reallocated if the frame size changed'''
+        if shape is not None and shape != self.shape:
+            self.shape = shape
+            self.ring = np.zeros((self.count,) + shape, np.uint8) if self.mode == 'window' else None
+            self.sum = np.zeros(shape, np.uint32 if self.mode == 'window' else np.uint16)
+            self.tmp = np.zeros(shape, self.sum.dtype)
+            self.out = np.zeros(shape, np.uint8)
+        elif self.shape is not None:
+            self.sum.fill(0)
+        self.n = 0
+        self.index = 0
+        self.fresh = False
+
+    def add(self, img):
+        if img.shape != self.shape:
+            self.reset(img.shape)
+        if self.mode == 'window':
+            if self.n == self.count:
+                np.subtract(self.sum, self.ring[self.index], out=self.sum)
+            else:
+                self.n += 1
+            np.add(self.sum, img, out=self.sum)
+            self.ring[self.index] = img
+            self.index = (self.index + 1) % self.count
+        elif self.n == 0:
+            # the first frame is the average so far
+            self.sum[...] = img
+            np.left_shift(self.sum, 8, out=self.sum)
+            self.n = 1
+        else:
+            # sum += w*(img - sum/256) with w = a/256, as
+            # sum - a*(sum>>8) + a*img: never negative, never over 255*257
+            a = min(int(round(256.0/self.count)), 256)
+            np.right_shift(self.sum, 8, out=self.tmp)
+            np.multiply(self.tmp, a, out=self.tmp)
+            np.subtract(self.sum, self.tmp, out=self.sum)
+            np.multiply(img, a, out=self.tmp, dtype=np.uint16)
+            np.add(self.sum, self.tmp, out=self.sum)
+        self.fresh = False
+
+    def frame(self):
+        '''The current average, as uint8'''
+        if self.shape is None or self.n == 0:
+            return None
+        if not self.fresh:
+            if self.mode == 'window':
+                # divide by n as a multiply and shift; sum*recip stays under 2**32
+                np.multiply(self.sum, (1 << 16)/self.n, out=self.tmp)
+                np.add(self.tmp, 1 << 15, out=self.tmp)
+                np.right_shift(self.tmp, 16, out=self.tmp)
+                np.copyto(self.out, self.tmp, casting='unsafe')
+            else:
+                # truncated, not rounded: the fixed point sum settles in
+                # [256*v, 256*v+255] for a steady v
+                np.right_shift(self.sum, 8, out=self.out, casting='unsafe')
+            self.fresh = True
+        return self.out
+
+
+# per-frame time Calibration.apply() should stay under for a 1024x768 frame
+# with dark and flat (see bench_uc480.py calibrate): a tenth of a frame at
+# the usual full-frame 20 fps
+CALIBRATION_BUDGET_MS = 5.0
+
+# per-frame time FocusMeter.measure() should stay under, tiles and all, at
+# any zoom (see bench_uc480.py focus)
+FOCUS_BUDGET_MS = 1.0
+
+
+class Calibration(object):
+    '''Dark-frame subtraction and flat-field correction of 8-bit frames.
+
+    Dark and flat frames are captured by averaging count frames fed in with
+    feed(), and saved in directory, one file per exposure and gain: select()
+    picks the set for the current settings. The flat becomes a gain map in
+    Q7 fixed point (gains of up to 2x), so apply() is a saturating uint8
+    subtract and a uint16 multiply and shift, in preallocated buffers.
+
+    Calibration frames cover the whole sensor: with sensorShape given, fed
+    frames of any other size (hardware AOI) are skipped, and a saved dark
+    and flat that don't match each other or it are ignored.
+    '''
+    def __init__(self, directory, sensorShape=None):
+        self.directory = directory
+        self.sensorShape = sensorShape
+        # dark and flat (uint8, or None) by settings, as loaded or captured
+        self.frames = {}
+        self.key = None
+        self.dark = None
+        self.gainMap = None
+        self.shape = None
+        # calibration frame being captured: kind, frames wanted, running sum
+        self.capturing = None
+        self.wanted = 0
+        self.n = 0
+        self.sum = None
+        self.applied = 0
+        self.elapsed = 0.0
+
+    def path(self, key):
+        return os.path.join(self.directory, 'calibration_%sms_gain%d.npz' % key)
+
+    def select(self, exposure, gain):
+        '''Use the calibration for these settings, if there is one'''
+        key = ('%.3f' % exposure, int(gain))
+        if key == self.key:
+            return
+        self.key = key
+        if key not in self.frames:
+            frames = {'dark': None, 'flat': None}
+            if os.path.exists(self.path(key)):
+                saved = np.load(self.path(key))
+                for kind in saved.files:
+                    frames[kind] = saved[kind]
+            self.frames[key] = frames
+        self.prepare()
+
+    def prepare(self):
+        '''Work out what apply() needs from the current dark and flat; False
+        (and nothing to apply) if they don't fit together'''
+        frames = self.frames[self.key]
+        self.dark = None
+        self.gainMap = None
+        shapes = set(v.shape for v in frames.values() if v is not None)
+        if self.sensorShape is not None:
+            shapes.add(tuple(self.sensorShape))
+        if len(shapes) > 1:
+            print 'Ignoring calibration for exposure %s ms, gain %d: frame sizes %s' % \
+                (self.key + (', '.join('%dx%d' % s[::-1] for s in shapes),))
+            return False
+        self.dark = frames['dark']
+        if frames['flat'] is not None:
+            flat = frames['flat'].astype(np.float32)
+            if self.dark is not None:
+                flat -= self.dark
+            flat = np.maximum(flat, 1)
+            gain = np.round(128*flat.mean()/flat)
+            self.gainMap = np.clip(gain, 0, 256).astype(np.uint16)
+        return True
+
+    @property
+    def active(self):
+        return self.dark is not None or self.gainMap is not None
+
+    def startCapture(self, kind, count):
+        '''Average the next count frames fed in into a new dark or flat,
+        for the settings last select()ed'''
+        if kind not in ('dark', 'flat'):
+            raise ValueError('unknown calibration frame %s' % kind)
+        self.capturing = kind
+        self.wanted = count
+        self.n = 0
+        self.sum = None
+
+    def feed(self, img):
+        '''Add a raw frame to the capture; True once it's finished and saved'''
+        if self.capturing is None:
+            return False
+        if self.sensorShape is not None and img.shape != tuple(self.sensorShape):
+            return False
+        if self.sum is None or self.sum.shape != img.shape:
+            self.sum = np.zeros(img.shape, np.uint32)
+            self.n = 0
+        np.add(self.sum, img, out=self.sum)
+        self.n += 1
+        if self.n < self.wanted:
+            return False
+        frames = self.frames[self.key]
+        frame = ((self.sum + self.n/2)/self.n).astype(np.uint8)
+        self.capturing, kind = None, self.capturing
+        self.sum = None
+        for other in frames:
+            # the new frame wins over one of another size
+            if frames[other] is not None and frames[other].shape != frame.shape:
+                frames[other] = None
+        frames[kind] = frame
+        # only a pair that works gets saved
+        if not self.prepare():
+            frames[kind] = None
+            return False
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        np.savez(self.path(self.key), **dict((k, v) for k, v in frames.items() if v is not None))
+        return True
+
+    def apply(self, img, origin=(0,0)):
+        '''Corrected copy of img, which sits at origin on the sensor. Comes
+        back in the same buffer every time; img itself if there's nothing
+        to apply or the calibration doesn't cover it.'''
+        if not self.active:
+            return img
+        start = time.time()
+        x, y = origin
+        h, w = img.shape
+        full = self.dark if self.dark is not None else self.gainMap
+        if y+h > full.shape[0] or x+w > full.shape[1]:
+            return img
+        if img.shape != self.shape:
+            self.shape = img.shape
+            self.out = np.empty(img.shape, np.uint8)
+            self.tmp = np.empty(img.shape, np.uint16)
+        src = img
+        if self.dark is not None:
+            # saturating subtract: max(img,dark) - dark
+            dark = self.dark[y:y+h, x:x+w]
+            np.maximum(img, dark, out=self.out)
+            np.subtract(self.out, dark, out=self.out)
+            src = self.out
+        if self.gainMap is not None:
+            self.tmp[...] = src
+            np.multiply(self.tmp, self.gainMap[y:y+h, x:x+w], out=self.tmp)
+            np.right_shift(self.tmp, 7, out=self.tmp)
+            # (clip is quicker than minimum here)
+            np.clip(self.tmp, 0, 255, out=self.tmp)
+            np.copyto(self.out, self.tmp, casting='unsafe')
+        self.applied += 1
+        self.elapsed += time.time() - start
+        return self.out
+
+    def cost(self):
+        '''Mean apply() time so far, in ms'''
+        return 1e3*self.elapsed/max(self.applied, 1)
+
+
+class ToneMap(object):
+    '''Display-only tone curve: levels (black to white input mapped onto the
+    full range), software gain, gamma and contrast about mid-grey, folded
+    into one 256-entry lookup table. The table is only rebuilt when one of
+    them changes.
+
+    With auto on, the levels are stretched to the lo and hi percentiles of
+    each frame, from a histogram of every stride-th pixel.
+    '''
+    def __init__(self, auto=False, lo=0.5, hi=99.5, stride=4):
+        self.gain = 1.0
+        self.gamma = 1.0
+        self.contrast = 1.0
+        self.black = 0
+        self.white = 255
+        self.auto = auto
+        self.lo = lo
+        self.hi = hi
+        self.stride = stride
+        self.lut = np.arange(256, dtype=np.uint8)
+        self.built = None
+        self.out = None
+
+    def reset(self):
+        self.gain = self.gamma = self.contrast = 1.0
+        self.black, self.white = 0, 255
+        self.auto = False
+
+    @property
+    def identity(self):
+        return self.params() == (1.0, 1.0, 1.0, 0, 255)
+
+    def params(self):
+        return (self.gain, self.gamma, self.contrast, self.black, self.white)
+
+    def build(self):
+        x = np.arange(256, dtype=np.float64)
+        v = np.clip((x - self.black)/max(self.white - self.black, 1), 0, 1)
+        v = np.clip(v*self.gain, 0, 1)**(1.0/self.gamma)
+        v = (v - 0.5)*self.contrast + 0.5
+        self.lut = np.clip(np.round(255*v), 0, 255).astype(np.uint8)
+        self.built = self.params()
+
+    def stretch(self, img):
+        '''Set the levels to img's lo and hi percentiles'''
+        counts = np.bincount(img[::self.stride, ::self.stride].ravel(), minlength=256)
+        cdf = np.cumsum(counts)
+        self.black = int(np.searchsorted(cdf, cdf[-1]*self.lo/100.0))
+        self.white = max(int(np.searchsorted(cdf, cdf[-1]*self.hi/100.0)), self.black + 1)
+
+    def apply(self, img):
+        '''img through the tone curve; img itself if the curve does nothing.
+        The result comes back in the same buffer while img's size stays the same.'''
+        import cv2
+        if self.auto:
+            self.stretch(img)
+        if self.identity:
+            return img
+        if self.out is None or self.out.shape != img.shape:
+            self.out = np.empty(img.shape, np.uint8)
+        cv2.LUT(img, self.table(), self.out)
+        return self.out
+
+    def table(self):
+        '''The lookup table for the current settings'''
+        if self.params() != self.built:
+            self.build()
+        return self.lut
+
+    def status(self):
+        text = 'gain %.2f gamma %.2f contrast %.2f' % (self.gain, self.gamma, self.contrast)
+        if self.auto:
+            text += ' auto %d-%d' % (self.black, self.white)
+        return text
+
+
+class Work(object):
+    '''A frame on its way through a Pipeline. Stages replace image (and set
+    reused if the new one is a buffer they'll write again) and can leave
+    anything else they like on it for later stages.'''
+    def __init__(self, image, number=0, time=0.0, origin=(0,0), reused=False):
+        self.image = image
+        self.number = number
+        self.time = time
+        # where image sits on the sensor
+        self.origin = origin
+        self.reused = reused
+
+
+class Stage(object):
+    '''A named step of a Pipeline, with the time of its last window runs'''
+    def __init__(self, name, func, needed=None, window=100):
+        self.name = name
+        self.func = func
+        self.needed = needed
+        self.times = np.zeros(window)
+        self.runs = 0
+        self.skipped = 0
+
+    def stats(self):
+        '''(mean, max) ms over the last window runs'''
+        if not self.runs:
+            return 0.0, 0.0
+        t = self.times[:min(self.runs, len(self.times))]
+        return 1e3*t.mean(), 1e3*t.max()
+
+
+class Pipeline(object):
+    '''Frame processing as named stages run in order, each func(work) on a
+    Work. A stage with a needed() that returns False right now, because
+    nothing would use what it makes, is skipped. Each run of a stage is
+    timed, for stats() over the last window frames.
+    '''
+    def __init__(self, window=100):
+        self.stages = []
+        self.window = window
+
+    def add(self, name, func, needed=None, before=None):
+        '''Add a stage at the end, or before the stage named before'''
+        stage = Stage(name, func, needed, self.window)
+        names = [s.name for s in self.stages]
+        self.stages.insert(names.index(before) if before is not None else len(names), stage)
+        return stage
+
+    def remove(self, name):
+        self.stages = [s for s in self.stages if s.name != name]
+
+    def run(self, work):
+        for stage in self.stages:
+            if stage.needed is not None and not stage.needed():
+                stage.skipped += 1
+                continue
+            start = timer()
+            stage.func(work)
+            stage.times[stage.runs % len(stage.times)] = timer() - start
+            stage.runs += 1
+        return work
+
+    def report(self):
+        '''One line per stage: mean and max ms per run, and runs/skips'''
+        lines = []
+        for stage in self.stages:
+            mean, worst = stage.stats()
+            lines.append('%-10s %6.2f ms mean %6.2f ms max  (%d run, %d skipped)' %
+                         (stage.name, mean, worst, stage.runs, stage.skipped))
+        return '\n'.join(lines)
+
+
+class FocusMeter(object):
+    '''Focus score of each frame: the variance of its Laplacian, which goes
+    up as edges get sharper. Only every step-th pixel each way is used, step
+    picked so about samples pixels are, which keeps it well under a
+    millisecond at any zoom. Scores only compare at the same size and step,
+    so the history starts over when either changes.
+
+    Keeps the last history scores for a graph and the best since the last
+    reset (peak). With tiles on, also the score of each of a grid of tiles,
+    as heat: tiles[0] rows by tiles[1] columns.
+    '''
+    def __init__(self, samples=160*120, history=200, tiles=(4,4)):
+        self.samples = samples
+        self.scores = np.zeros(history)
+        self.tiles = tiles
+        self.shape = None
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.score = 0.0
+        self.peak = 0.0
+        self.heat = None
+
+    def step(self, shape):
+        return max(1, int(np.ceil(np.sqrt(shape[0]*shape[1]/float(self.samples)))))
+
+    def measure(self, img, tiles=False):
+        '''Score img (and its tiles if asked), and return the score'''
+        step = self.step(img.shape)
+        s = img[::step, ::step]
+        if (s.shape, step) != self.shape:
+            self.shape = (s.shape, step)
+            self.lap = np.zeros((s.shape[0]-2, s.shape[1]-2), np.int32)
+            self.reset()
+        lap = self.lap
+        # 4 times the centre minus the four neighbours
+        np.multiply(s[1:-1,1:-1], 4, out=lap, dtype=np.int32)
+        lap -= s[:-2,1:-1]
+        lap -= s[2:,1:-1]
+        lap -= s[1:-1,:-2]
+        lap -= s[1:-1,2:]
+        self.score = lap.var()
+        self.scores[self.n % len(self.scores)] = self.score
+        self.n += 1
+        self.peak = max(self.peak, self.score)
+        if tiles:
+            ty,tx = self.tiles
+            th,tw = lap.shape[0]//ty, lap.shape[1]//tx
+            blocks = lap[:ty*th,:tx*tw].reshape(ty, th, tx, tw)
+            self.heat = blocks.var(axis=(1,3))
+        else:
+            self.heat = None
+        return self.score
+
+    def history(self):
+        '''The scores kept, oldest first'''
+        if self.n <= len(self.scores):
+            return self.scores[:self.n]
+        return np.roll(self.scores, -(self.n % len(self.scores)))
@@ -0,0 +1,662 @@
+import os
+import sys
+import zlib
+import collections
+import multiprocessing
+import subprocess as sp
+import threading
+import time
+import numpy as np
+
+import uc480
+
+
+ffmpeg = 'ffmpeg'
+
+# raw recordings: frames back to back in <name>.raw, plus a <name>.raw.idx
+# sidecar holding this header and then one INDEX_DTYPE record per frame
+INDEX_HEADER = np.dtype([('magic', 'S4'), ('width', '<u4'), ('height', '<u4'), ('count', '<u4')])
+INDEX_DTYPE = np.dtype([('frame', '<u8'), ('time', '<f8'), ('exposure', '<f4'), ('gain', '<i4')])
+INDEX_MAGIC = 'UCRI'
+
+# compressed stacks: chunks of frames compressed together, back to back in
+# <name>.ucs; the <name>.ucs.idx sidecar has this header, the INDEX_DTYPE
+# records, then a CHUNK_DTYPE record per chunk
+STACK_HEADER = np.dtype(INDEX_HEADER.descr + [('chunk', '<u4'), ('codec', 'S8')])
+CHUNK_DTYPE = np.dtype([('offset', '<u8'), ('size', '<u8')])
+STACK_MAGIC = 'UCSI'
+
+# per-frame metadata for any recording: <recording>.meta has this header,
+# then one META_DTYPE record per frame handed to the recorder
+META_HEADER = np.dtype([('magic', 'S4'), ('size', '<u4')])
+META_DTYPE = np.dtype([('frame', '<u8'), ('time', '<f8'), ('gain', '<i4'), ('exposure', '<f4'),
+                       ('zoom', 'u1'), ('average', 'u1'), ('pad', 'V6')])
+META_MAGIC = 'UCMD'
+
+
+# ffmpeg output options for each codec, and the container it goes in:
+# ffv1 and raw are lossless (for analysis), mjpeg and x264 are for previews
+CODECS = {
+    'ffv1': (['-vcodec', 'ffv1', '-level', '3', '-g', '1'], 'mkv'),
+    'raw': (['-vcodec', 'rawvideo'], 'avi'),
+    'mjpeg': (['-vcodec', 'mjpeg', '-q:v', '3'], 'avi'),
+    'x264': (['-vcodec', 'libx264', '-crf', '18', '-pix_fmt', 'yuv420p'], 'mp4'),
+}
+
+# ffmpeg's name for the pixel layout of each camera color mode
+PIX_FMTS = {
+    uc480.IS_SET_CM_Y8: 'gray',
+    uc480.IS_SET_CM_RGB24: 'bgr24',
+    uc480.IS_SET_CM_RGB32: 'bgra',
+    uc480.IS_SET_CM_UYVY: 'uyvy422',
+}
+
+
+def encoderCommand(fname, width, height, fps, codec='mjpeg', pixFmt='gray', preset='veryfast', threads=0):
+    '''ffmpeg command line encoding raw frames from a pipe into fname.
+    preset only matters for x264; threads=0 lets ffmpeg choose'''
+    options, ext = CODECS[codec]
+    command = [ffmpeg,
+               '-y', # overwrite output file if it exists
+               '-f', 'rawvideo',
+               '-pix_fmt', pixFmt,
+               '-s', '%dx%d' % (width, height),
+               '-r', '%.3f' % fps,
+               '-an', # no audio
+               '-i', '-'] # frames come from the pipe
+    command += options
+    if codec == 'x264':
+        command += ['-preset', preset]
+    command += ['-threads', str(threads), fname]
+    return command
+
+
+class Recorder(object):
+    '''Feeds frames to an ffmpeg pipe from its own thread, so a slow encoder
+    or disk never holds up capture and display.
+
+    The video runs at a constant fps, and each frame goes in at the slot its
+    device timestamp says it belongs in: where frames were dropped the last
+    one is repeated, so playback keeps real time. Frames written without a
+    time just go in one after the other.
+
+    write() only queues a reference to the frame: don't change the array
+    afterwards. If the writer falls behind by more than queueSize frames the
+    oldest ones are dropped (or write() blocks, with policy=uc480.BLOCK).
+    Frames that aren't width x height are dropped too.
+    '''
+    def __init__(self, fname, width, height, fps, codec='mjpeg', colorMode=uc480.IS_SET_CM_Y8,
+                 preset='veryfast', threads=0, queueSize=32, policy=uc480.DROP_OLDEST, **popenArgs):
+        self.fname = fname
+        self.shape = (height, width)
+        self.fps = fps
+        self.command = encoderCommand(fname, width, height, fps, codec, PIX_FMTS[colorMode], preset, threads)
+        self.queue = uc480.FrameQueue(queueSize, policy)
+        self.video = sp.Popen(self.command, stdin=sp.PIPE, **popenArgs)
+        self.written = 0
+        self.repeated = 0
+        self.skipped = 0
+        self.start = None
+        self.last = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='recorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, img, frame=0, time=None, exposure=0.0, gain=0):
+        self.queue.put((img, time))
+
+    def run(self):
+        while True:
+            item = self.queue.get(0.5)
+            if item is None:
+                if self.queue.closed:
+                    break
+                continue
+            img, t = item
+            if img.shape[:2] != self.shape:
+                self.skipped += 1
+                continue
+            try:
+                self.place(img, t)
+            except IOError, e:
+                # ffmpeg went away; stop taking frames
+                self.error = e
+                self.queue.close()
+                break
+
+    def place(self, img, t):
+        '''Write img at the slot for device time t, filling any gap before it'''
+        if t is not None:
+            if self.start is None:
+                self.start = t
+            slot = int(round((t - self.start)*self.fps))
+            if slot < self.written:
+                # a second frame in the same slot
+                self.skipped += 1
+                return
+            while self.last is not None and self.written < slot:
+                self.send(self.last)
+                self.repeated += 1
+        self.send(img)
+        self.last = img
+
+    def send(self, img):
+        # straight from the array's memory, no tostring() copy
+        self.video.stdin.write(np.ascontiguousarray(img).data)
+        self.written += 1
+
+    def stop(self):
+        '''Write out whatever is still queued, then close the pipe and wait
+        for ffmpeg to finish the file'''
+        self.queue.close()
+        self.thread.join()
+        self.video.stdin.close()
+        self.video.wait()
+        self.last = None
+
+    @property
+    def dropped(self):
+        return self.queue.dropped + self.skipped
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def status(self):
+        return '%d written (%d repeated), %d dropped, %d queued' % \
+            (self.written, self.repeated, self.dropped, self.depth)
+
+
+class StillWriter(object):
+    '''Saves still images from a few background threads, so a snapshot or a
+    burst of them never holds up the live view.
+
+    save() only queues a reference to the image: don't change the array
+    afterwards. The format goes by the file's extension (.png and .tif are
+    lossless). callback(fname, ok), if given, is called from the writing
+    thread once the file is saved. Stills are never dropped: if the queue
+    is full, save() waits.
+    '''
+    def __init__(self, threads=2, queueSize=256, pngCompression=1, jpegQuality=95):
+        import cv2
+        self.params = {'.png': [cv2.IMWRITE_PNG_COMPRESSION, pngCompression],
+                       '.jpg': [cv2.IMWRITE_JPEG_QUALITY, jpegQuality]}
+        self.queue = uc480.FrameQueue(queueSize, uc480.BLOCK)
+        self.saved = 0
+        self.failed = 0
+        self.threads = [threading.Thread(target=self.run, name='stills') for i in range(threads)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def save(self, fname, img, callback=None):
+        self.queue.put((fname, img, callback))
+
+    def run(self):
+        import cv2
+        while True:
+            item = self.queue.get(0.5)
+            if item is None:
+                if self.queue.closed:
+                    break
+                continue
+            fname, img, callback = item
+            params = self.params.get(os.path.splitext(fname)[1].lower(), [])
+            # imwrite lets go of the GIL, so the threads do save in parallel
+            ok = cv2.imwrite(fname, img, params)
+            if ok:
+                self.saved += 1
+            else:
+                self.failed += 1
+            if callback is not None:
+                callback(fname, ok)
+
+    def stop(self):
+        '''Save whatever is still queued, then stop the threads'''
+        self.queue.close()
+        for thread in self.threads:
+            thread.join()
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+
+class RawRecorder(object):
+    '''Records raw 8-bit frames into a preallocated memory-mapped file, with
+    a binary index of frame number, device time, exposure and gain per frame.
+    No encoding, so it keeps up with the sensor; see convertRaw() for
+    turning it into a video afterwards.
+
+    Room for maxFrames is set aside up front; frames past that are counted
+    as dropped (full says when it's come to that). stop() trims the files to
+    what was actually written.
+    '''
+    def __init__(self, fname, width, height, maxFrames):
+        self.fname = fname
+        self.maxFrames = maxFrames
+        self.data = np.memmap(fname, np.uint8, 'w+', shape=(maxFrames, height, width))
+        self.header = np.memmap(fname + '.idx', INDEX_HEADER, 'w+', shape=(1,))
+        self.header[0] = (INDEX_MAGIC, width, height, 0)
+        self.header.flush()
+        self.index = np.memmap(fname + '.idx', INDEX_DTYPE, 'r+',
+                               offset=INDEX_HEADER.itemsize, shape=(maxFrames,))
+        self.written = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def write(self, img, frame=0, time=0.0, exposure=0.0, gain=0):
+        with self.lock:
+            if self.data is None or self.written >= self.maxFrames or \
+                    img.shape != self.data.shape[1:]:
+                self.dropped += 1
+                return False
+            self.data[self.written] = img
+            self.index[self.written] = (frame, time, exposure, gain)
+            self.written += 1
+            return True
+
+    def stop(self):
+        with self.lock:
+            if self.data is None:
+                return
+            self.header[0]['count'] = self.written
+            for m in (self.data, self.header, self.index):
+                m.flush()
+                m._mmap.close()
+            self.data = self.header = self.index = None
+        # drop the space we never used
+        frameBytes = os.path.getsize(self.fname)/self.maxFrames
+        for fname, size in [(self.fname, self.written*frameBytes),
+                            (self.fname + '.idx', INDEX_HEADER.itemsize + self.written*INDEX_DTYPE.itemsize)]:
+            f = open(fname, 'r+b')
+            f.truncate(size)
+            f.close()
+
+    @property
+    def full(self):
+        return self.written >= self.maxFrames
+
+    def status(self):
+        return '%d/%d written, %d dropped' % (self.written, self.maxFrames, self.dropped)
+
+
+class BurstRecorder(object):
+    '''Keeps the last preSeconds of frames in a RAM ring, all the time, so
+    a recording can start before whatever we wanted to catch. trigger()
+    saves the ring plus the next postSeconds as a raw recording (see
+    RawRecorder), written out from a background thread.
+
+    The ring is allocated and touched up front, capped at maxBytes; if the
+    cap is tight the pre-trigger part shrinks first. write() just copies
+    into the ring, so it can go on the acquisition thread. While a burst is
+    being saved, frames after its end are dropped, not kept for the next one.
+    A burst whose frames stop coming (they're the wrong size, or the camera
+    stopped) is saved as far as it got, a second after postSeconds.
+    '''
+    def __init__(self, width, height, fps, preSeconds=5, postSeconds=5, maxBytes=512*2**20):
+        slots = max(int(maxBytes)/(width*height), 1)
+        self.post = min(max(int(postSeconds*fps + 0.5), 1), slots)
+        self.pre = min(int(preSeconds*fps + 0.5), slots - self.post)
+        self.postSeconds = postSeconds
+        self.deadline = None
+        slots = self.pre + self.post
+        self.frames = np.empty((slots, height, width), np.uint8)
+        # fault the pages in now rather than during the first pass
+        self.frames.fill(0)
+        self.index = np.zeros(slots, INDEX_DTYPE)
+        # frames written so far, where the ring's usable frames start, and
+        # the count the current burst was triggered at
+        self.count = 0
+        self.valid = 0
+        self.triggerAt = None
+        self.fname = None
+        self.callback = None
+        self.saved = 0
+        self.dropped = 0
+        self.stopping = False
+        self.lock = threading.Condition()
+        self.thread = None
+
+    def write(self, img, frame=0, time=0.0, exposure=0.0, gain=0):
+        with self.lock:
+            if img.shape != self.frames.shape[1:] or \
+                    (self.triggerAt is not None and self.count >= self.triggerAt + self.post):
+                self.dropped += 1
+                return False
+            i = self.count % len(self.frames)
+            self.frames[i] = img
+            self.index[i] = (frame, time, exposure, gain)
+            self.count += 1
+            if self.triggerAt is not None:
+                self.lock.notify()
+            return True
+
+    def trigger(self, fname, callback=None):
+        '''Start saving a burst to fname; False if one is still being saved.
+        callback(fname) is called from the saving thread when it's done.'''
+        with self.lock:
+            if self.triggerAt is not None:
+                return False
+            self.triggerAt = self.count
+            self.deadline = time.time() + self.postSeconds + 1
+            self.fname = fname
+            self.callback = callback
+            self.saved = 0
+        self.thread = threading.Thread(target=self.flush, name='burst')
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def flush(self):
+        # the burst's slots don't get overwritten until it's done, so the
+        # frames themselves are copied out without holding the lock
+        slots = len(self.frames)
+        start = max(self.valid, self.triggerAt - self.pre)
+        end = self.triggerAt + self.post
+        out = RawRecorder(self.fname, self.frames.shape[2], self.frames.shape[1], end - start)
+        for c in xrange(start, end):
+            with self.lock:
+                while self.count <= c and not self.stopping and time.time() < self.deadline:
+                    self.lock.wait(min(0.5, max(self.deadline - time.time(), 0.01)))
+                if self.count <= c:
+                    # stopped, or out of time, before the burst was complete
+                    break
+            entry = self.index[c % slots]
+            out.write(self.frames[c % slots], entry['frame'], entry['time'], entry['exposure'], entry['gain'])
+            self.saved += 1
+        out.stop()
+        with self.lock:
+            self.valid = self.count
+            self.triggerAt = None
+        if self.callback is not None:
+            self.callback(self.fname)
+
+    @property
+    def busy(self):
+        return self.triggerAt is not None
+
+    def stop(self):
+        '''Save what there is of a burst in progress and wait for it'''
+        if self.thread is not None:
+            with self.lock:
+                self.stopping = True
+                self.lock.notify()
+            self.thread.join()
+            self.thread = None
+            self.stopping = False
+
+    def status(self):
+        if self.busy:
+            return 'saving burst: %d saved' % self.saved
+        return '%d/%d frames buffered' % (min(self.count - self.valid, self.pre), self.pre)
+
+
+class MetadataWriter(object):
+    '''Logs a META_DTYPE record per recorded frame: frame number, device
+    time, and the gain, exposure, zoom and averaging it was shown with.
+    Records are gathered in a preallocated block and written bufferSize at
+    a time. Read it back with readMeta().
+    '''
+    def __init__(self, fname, bufferSize=256):
+        self.fname = fname
+        self.file = open(fname, 'wb')
+        np.array([(META_MAGIC, META_DTYPE.itemsize)], META_HEADER).tofile(self.file)
+        self.buffer = np.zeros(bufferSize, META_DTYPE)
+        self.filled = 0
+        self.written = 0
+        self.lock = threading.Lock()
+
+    def write(self, frame, time, gain=0, exposure=0.0, zoom=0, average=False):
+        with self.lock:
+            if self.file is None:
+                return False
+            r = self.buffer[self.filled]
+            r['frame'], r['time'], r['gain'], r['exposure'] = frame, time, gain, exposure
+            r['zoom'], r['average'] = zoom, average
+            self.filled += 1
+            if self.filled == len(self.buffer):
+                self.flush()
+            return True
+
+    def flush(self):
+        # called with the lock held
+        self.buffer[:self.filled].tofile(self.file)
+        self.written += self.filled
+        self.filled = 0
+
+    def stop(self):
+        with self.lock:
+            if self.file is None:
+                return
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+def readMeta(fname):
+    '''The META_DTYPE records of a .meta file, as a structured array'''
+    f = open(fname, 'rb')
+    header = np.fromfile(f, META_HEADER, count=1)[0]
+    if header['magic'] != META_MAGIC or header['size'] != META_DTYPE.itemsize:
+        raise ValueError('%s is not a frame metadata file' % fname)
+    meta = np.fromfile(f, META_DTYPE)
+    f.close()
+    return meta
+
+
+def compress(data, codec='zlib', level=1):
+    if codec == 'zlib':
+        return zlib.compress(data, level)
+    if codec == 'lz4':
+        import lz4.block
+        return lz4.block.compress(data, store_size=False)
+    raise ValueError('unknown codec %s' % codec)
+
+def decompress(data, size, codec='zlib'):
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'lz4':
+        import lz4.block
+        return lz4.block.decompress(data, uncompressed_size=size)
+    raise ValueError('unknown codec %s' % codec)
+
+def compressChunk(args):
+    # runs in the pool's worker processes
+    return compress(*args)
+
+
+class StackWriter(object):
+    '''Lossless recording for long acquisitions: frames are gathered into
+    chunks of chunkSize, compressed in a pool of worker processes, and
+    appended to <fname> a chunk at a time. Read it back with StackReader.
+
+    write() only copies the frame into the chunk being filled, so it can go
+    on the acquisition thread. Chunks wait for the pool in a set of
+    preallocated buffers, each one only freed once its compressed chunk is
+    on disk; if all of them are taken the frame is dropped.
+    codec is 'zlib' or 'lz4' (needs the lz4 package).
+    '''
+    def __init__(self, fname, width, height, chunkSize=16, codec='zlib', level=1,
+                 processes=None, buffers=None):
+        self.fname = fname
+        self.shape = (height, width)
+        self.chunkSize = chunkSize
+        self.codec = codec
+        self.level = level
+        compress('', codec, level)
+        self.pool = multiprocessing.Pool(processes)
+        # enough chunks to keep every worker busy, and as many waiting
+        if buffers is None:
+            buffers = 2*(processes or multiprocessing.cpu_count()) + 1
+        self.free = [np.empty((chunkSize, height, width), np.uint8) for i in range(buffers)]
+        self.chunk = self.free.pop()
+        self.filled = 0
+        self.stopping = False
+        self.queue = uc480.FrameQueue(buffers, uc480.BLOCK)
+        self.index = []
+        self.chunks = []
+        self.file = open(fname, 'wb')
+        self.written = 0
+        self.dropped = 0
+        self.rawBytes = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='stack')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, img, frame=0, time=0.0, exposure=0.0, gain=0):
+        with self.lock:
+            if self.chunk is None or img.shape != self.chunk.shape[1:]:
+                self.dropped += 1
+                return False
+            self.chunk[self.filled] = img
+            self.index.append((frame, time, exposure, gain))
+            self.filled += 1
+            if self.filled == self.chunkSize:
+                self.queue.put((self.chunk, self.filled))
+                self.chunk = self.free.pop() if self.free else None
+                self.filled = 0
+            return True
+
+    def run(self):
+        # hand chunks to the pool, and write the results in order as they come
+        pending = collections.deque()
+        while True:
+            # look in on the pool more often while it has work
+            item = self.queue.get(0.01 if pending else 0.1)
+            if item is not None:
+                chunk, n = item
+                data = chunk[:n].tostring()
+                pending.append((chunk, len(data), self.pool.apply_async(compressChunk, ((data, self.codec, self.level),))))
+            while pending and pending[0][2].ready():
+                self.save(*pending.popleft())
+            if item is None and self.queue.closed:
+                while pending:
+                    self.save(*pending.popleft())
+                break
+
+    def save(self, chunk, rawSize, result):
+        data = result.get()
+        self.chunks.append((self.bytes, len(data)))
+        self.file.write(data)
+        self.rawBytes += rawSize
+        self.bytes += len(data)
+        self.written += 1
+        # the chunk's buffer can take frames again
+        with self.lock:
+            self.free.append(chunk)
+            if self.chunk is None and not self.stopping:
+                self.chunk = self.free.pop()
+
+    def stop(self):
+        '''Compress and write out everything written so far, then the index'''
+        with self.lock:
+            if self.filled:
+                self.queue.put((self.chunk, self.filled))
+            self.chunk = None
+            self.filled = 0
+            self.stopping = True
+        self.queue.close()
+        self.thread.join()
+        self.pool.close()
+        self.pool.join()
+        self.file.close()
+
+        height, width = self.shape
+        header = np.array([(STACK_MAGIC, width, height, len(self.index), self.chunkSize, self.codec)], STACK_HEADER)
+        f = open(self.fname + '.idx', 'wb')
+        header.tofile(f)
+        np.array(self.index, INDEX_DTYPE).tofile(f)
+        np.array(self.chunks, CHUNK_DTYPE).tofile(f)
+        f.close()
+
+    def status(self):
+        ratio = float(self.rawBytes)/max(self.bytes, 1)
+        return '%d frames, %d chunks written (%.1fx), %d dropped, %d queued' % \
+            (len(self.index), self.written, ratio, self.dropped, len(self.queue))
+
+
+class StackReader(object):
+    '''Random access to the frames of a StackWriter recording: stack[i] is
+    frame i, decompressing only its chunk (the last chunk read is kept)'''
+    def __init__(self, fname):
+        f = open(fname + '.idx', 'rb')
+        header = np.fromfile(f, STACK_HEADER, count=1)[0]
+        if header['magic'] != STACK_MAGIC:
+            raise ValueError('%s.idx is not a stack index' % fname)
+        self.count = int(header['count'])
+        self.shape = (int(header['height']), int(header['width']))
+        self.chunkSize = int(header['chunk'])
+        self.codec = header['codec']
+        self.index = np.fromfile(f, INDEX_DTYPE, count=self.count)
+        self.chunks = np.fromfile(f, CHUNK_DTYPE)
+        f.close()
+        self.file = open(fname, 'rb')
+        self.cached = None
+        self.cache = None
+
+    def __len__(self):
+        return self.count
+
+    def chunk(self, c):
+        if c != self.cached:
+            offset, size = self.chunks[c]
+            self.file.seek(int(offset))
+            n = min(self.chunkSize, self.count - c*self.chunkSize)
+            data = decompress(self.file.read(int(size)), n*self.shape[0]*self.shape[1], self.codec)
+            self.cache = np.fromstring(data, np.uint8).reshape((n,) + self.shape)
+            self.cached = c
+        return self.cache
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('frame %d out of range' % i)
+        return self.chunk(i/self.chunkSize)[i % self.chunkSize]
+
+    def close(self):
+        self.file.close()
+
+
+def readRaw(fname):
+    '''Open a raw recording: returns (frames, index), with frames an
+    (n,height,width) read-only memmap and index an INDEX_DTYPE array'''
+    header = np.fromfile(fname + '.idx', INDEX_HEADER, count=1)[0]
+    if header['magic'] != INDEX_MAGIC:
+        raise ValueError('%s.idx is not a raw recording index' % fname)
+    count = int(header['count'])
+    shape = (count, header['height'], header['width'])
+    if count == 0:
+        return np.zeros(shape, np.uint8), np.zeros(0, INDEX_DTYPE)
+    index = np.memmap(fname + '.idx', INDEX_DTYPE, 'r', offset=INDEX_HEADER.itemsize, shape=(count,))
+    frames = np.memmap(fname, np.uint8, 'r', shape=shape)
+    return frames, index
+
+def convertRaw(fname, out=None, codec='mjpeg'):
+    '''Encode a raw recording to a video with ffmpeg, at the frame rate
+    measured from its timestamps, with each frame at its recorded time'''
+    frames, index = readRaw(fname)
+    if out is None:
+        out = os.path.splitext(fname)[0] + '.' + CODECS[codec][1]
+    fps = 20.0
+    if len(index) > 1 and index['time'][-1] > index['time'][0]:
+        # count dropped frames too, so the gaps they left keep their length
+        span = max(index['frame'][-1] - index['frame'][0], len(index)-1)
+        fps = span/(index['time'][-1]-index['time'][0])
+    video = Recorder(out, frames.shape[2], frames.shape[1], fps, codec, policy=uc480.BLOCK)
+    for img, entry in zip(frames, index):
+        video.write(img, entry['frame'], entry['time'])
+    video.stop()
+    if video.video.returncode:
+        raise sp.CalledProcessError(video.video.returncode, video.command)
+    print 'Wrote %s: %s' % (out, video.status())
+    return out
+
+
+if __name__ == '__main__':
+    # python recorder.py file.raw [out.avi]
+    convertRaw(*sys.argv[1:3])
@@ -6,19 +6,33 @@ import textwrap
 import numpy as np
 from numpy import ctypeslib
 import ctypes
-import ctypes.util
-import ctypes.wintypes
 import warnings
+import contextlib
+import collections
+import threading
 
 from uc480_h import *
-from ctypes.wintypes import BYTE
-from ctypes.wintypes import WORD
-from ctypes.wintypes import DWORD
-from ctypes.wintypes import BOOL
-HCAM = ctypes.wintypes.HANDLE
-from ctypes.wintypes import HDC
-from ctypes.wintypes import HWND
-from ctypes.wintypes import INT
+if os.name=='nt':
+	import ctypes.wintypes
+	from ctypes.wintypes import BYTE
+	from ctypes.wintypes import WORD
+	from ctypes.wintypes import DWORD
+	from ctypes.wintypes import BOOL
+	from ctypes.wintypes import HDC
+	from ctypes.wintypes import HWND
+	from ctypes.wintypes import HANDLE
+	from ctypes.wintypes import INT
+else:
+	# ctypes.wintypes won't import off windows, so spell out the same widths
+	BYTE = ctypes.c_byte
+	WORD = ctypes.c_ushort
+	DWORD = ctypes.c_uint32
+	BOOL = ctypes.c_int32
+	HANDLE = ctypes.c_void_p
+	HDC = HANDLE
+	HWND = HANDLE
+	INT = ctypes.c_int
+HCAM = HANDLE
 c_char = ctypes.c_byte
 c_char_p = ctypes.POINTER(ctypes.c_byte)
 c_int_p = ctypes.POINTER(ctypes.c_int)
@@ -26,6 +40,10 @@ from ctypes import c_int
 IS_CHAR = ctypes.c_byte 
 verbose = False
 
+# win32 wait results, for the frame event
+WAIT_OBJECT_0 = 0x00000000
+WAIT_TIMEOUT = 0x00000102
+
 #class CAMINFO(ctypes.Structure):
 #	_fields_ = [("SerNo[12]    ",ctypes.c_char*12),  # (11 char)   
 #	            ("ID[20]       ",ctypes.c_char*20),  # e.g. "Company Name"      
@@ -72,95 +90,52 @@ verbose = False
 ##} REVISIONINFO, *PREVISIONINFO;
 #PREVISIONINFO = ctypes.POINTER(REVISIONINFO)
 #
-#class UC480_CAMERA_INFO(ctypes.Structure):
-#	_fields_ = [("dwCameraID   	",DWORD  ),	# this is the user defineable camera ID
-#				("dwDeviceID   	",DWORD  ),	# this is the systems enumeration ID
-#				("dwSensorID   	",DWORD  ),	# this is the sensor ID e.g. IS_SENSOR_C0640R13M
-#				("dwInUse      	",DWORD  ),	# flag, whether the camera is in use or not
-#				("SerNo[16]    	",IS_CHAR*16),	# serial numer of the camera
-#				("Model[16]    	",IS_CHAR*16),	# model name of the camera
-#				("dwReserved[16]",DWORD  *16)] #
-##}UC480_CAMERA_INFO, *PUC480_CAMERA_INFO;
-#PUC480_CAMERA_INFO = ctypes.POINTER(UC480_CAMERA_INFO)
+class UC480_CAMERA_INFO(ctypes.Structure):
+	_fields_ = [("dwCameraID",   DWORD  ),	# this is the user defineable camera ID
+				("dwDeviceID",   DWORD  ),	# this is the systems enumeration ID
+				("dwSensorID",   DWORD  ),	# this is the sensor ID e.g. IS_SENSOR_C0640R13M
+				("dwInUse",      DWORD  ),	# flag, whether the camera is in use or not
+				("SerNo",        ctypes.c_char*16),	# serial numer of the camera
+				("Model",        ctypes.c_char*16),	# model name of the camera
+				("dwReserved",   DWORD  *16)] #
+#}UC480_CAMERA_INFO, *PUC480_CAMERA_INFO;
+PUC480_CAMERA_INFO = ctypes.POINTER(UC480_CAMERA_INFO)
 
-if os.name=='nt':
-    # UNTESTED: Please report results to http://code.google.com/p/pylibuc480/issues
-    libname = 'uc480_64'
-    include_uc480_h = os.environ['PROGRAMFILES']+'\\Thorlabs DCU camera\\Develop\\Include\\uc480.h'
-    lib = ctypes.util.find_library(libname)
-    if lib is None:
-		print 'uc480.dll not found'
+def UC480_CAMERA_LIST(count):
+	'''The camera list struct ends in a variable-length array, so make one
+	with room for count cameras'''
+	class UC480_CAMERA_LIST(ctypes.Structure):
+		_fields_ = [("dwCount", DWORD                    ),
+					("uci",     UC480_CAMERA_INFO*count  )]
+	return UC480_CAMERA_LIST
 
-		
-libuc480 = ctypes.cdll.LoadLibrary(lib)
-if libuc480 is not None:
-	uc480_h_name = 'uc480_h'
-	try:
-		uc480_h = "uc480_h"
-		#from uc480_h import *
-		#exec 'from %s import *' % (uc480_h_name)
-	except ImportError:
-		uc480_h = None
-	if uc480_h is None:
-		assert os.path.isfile (include_uc480_h), `include_uc480_h`
-		d = {}
-		l = ['# This file is auto-generated. Do not edit!']
-		error_map = {}
-		f = open (include_uc480_h, 'r')
-		
-		def is_number(s):
-			try:
-				float(s)
-				return True
-			except ValueError:
-				return False
+class UC480_TIME(ctypes.Structure):
+	_pack_ = 1
+	_fields_ = [("wYear",         WORD    ),
+				("wMonth",        WORD    ),
+				("wDay",          WORD    ),
+				("wHour",         WORD    ),
+				("wMinute",       WORD    ),
+				("wSecond",       WORD    ),
+				("wMilliseconds", WORD    ),
+				("byReserved",    BYTE*10 )]    # --24
 				
-		for line in f.readlines():
-			if not line.startswith('#define'): continue
-			i = line.find('//')
-			words = line[7:i].strip().split(None, 2)
-			if len (words)!=2: continue
-			name, value = words
-			if value.startswith('0x'):
-				exec '%s = %s' % (name, value)
-				d[name] = eval(value)
-				l.append('%s = %s' % (name, value))
-			# elif name.startswith('DAQmxError') or name.startswith('DAQmxWarning'):
-				# assert value[0]=='(' and value[-1]==')', `name, value`
-				# value = int(value[1:-1])
-				# error_map[value] = name[10:]
-			# elif name.startswith('DAQmx_Val') or name[5:] in ['Success','_ReadWaitMode']:
-				# d[name] = eval(value)
-				# l.append('%s = %s' % (name, value))
-			elif is_number(value):
-				d[name] = eval(value)
-				l.append('%s = %s' % (name, value))
-			elif value.startswith('UC'):
-				print value
-				d[name] = unicode(value[3:-1])
-				l.append('%s = unicode("%s")' % (name, value[3:-1]))
-			elif d.has_key(value):
-				d[name] = d[value]
-				l.append('%s = %s' % (name, d[value]))
-			else:
-				d[name] = value
-				l.append('%s = %s' % (name, value))
-				pass
-		l.append('error_map = %r' % (error_map))
-		fn = os.path.join (os.path.dirname(os.path.abspath (__file__)), uc480_h_name+'.py')
-		print 'Generating %r' % (fn)
-		f = open(fn, 'w')
-		f.write ('\n'.join(l) + '\n')
-		f.close()
-		print 'Please upload generated file %r to http://code.google.com/p/pylibuc480/issues' % (fn)
-	else:
-		pass
-		#d = uc480_h.__dict__
-	
-#	for name, value in d.items():
-#		if name.startswith ('_'): continue
-#		exec '%s = %r' % (name, value)
-
+class UC480_IMAGE_INFO(ctypes.Structure):
+	_pack_ = 1
+	_fields_ = [("dwFlags",             DWORD           ),
+				("byReserved1",         BYTE*4          ),
+				("u64TimestampDevice",  ctypes.c_uint64 ),  # in 0.1 us ticks
+				("TimestampSystem",     UC480_TIME      ),
+				("dwIoStatus",          DWORD           ),
+				("wAOIIndex",           WORD            ),
+				("wAOICycle",           WORD            ),
+				("u64FrameNumber",      ctypes.c_uint64 ),
+				("dwImageBuffers",      DWORD           ),
+				("dwImageBuffersInUse", DWORD           ),
+				("dwReserved3",         DWORD           ),
+				("dwImageHeight",       DWORD           ),
+				("dwImageWidth",        DWORD           )]  # --76
+PUC480_IMAGE_INFO = ctypes.POINTER(UC480_IMAGE_INFO)
 
 # def CHK(return_code, funcname, *args):
     # """
@@ -198,37 +173,243 @@ if libuc480 is not None:
                 # sys.stderr.write('%s%s warning:%s\n' % (funcname, args, text))
     # return return_code
 	
+# argument types of every is_* function we use; all of them return an INT
+PROTOTYPES = {
+	'GetNumberOfCameras': [c_int_p],
+	'GetCameraList':   [ctypes.c_void_p],
+	'InitCamera':      [ctypes.POINTER(HCAM), HWND],
+	'ExitCamera':      [HCAM],
+	'SaveImage':       [HCAM, ctypes.c_char_p],
+	'AllocImageMem':   [HCAM, INT, INT, INT, ctypes.POINTER(c_char_p), c_int_p],
+	'FreeImageMem':    [HCAM, c_char_p, INT],
+	'SetImageMem':     [HCAM, c_char_p, INT],
+	'AddToSequence':   [HCAM, c_char_p, INT],
+	'ClearSequence':   [HCAM],
+	'GetActSeqBuf':    [HCAM, c_int_p, ctypes.POINTER(c_char_p), ctypes.POINTER(c_char_p)],
+	'LockSeqBuf':      [HCAM, INT, c_char_p],
+	'UnlockSeqBuf':    [HCAM, INT, c_char_p],
+	'CopyImageMem':    [HCAM, c_char_p, INT, ctypes.c_void_p],
+	'GetImageInfo':    [HCAM, INT, PUC480_IMAGE_INFO, INT],
+	'GetError':        [HCAM, c_int_p, ctypes.POINTER(ctypes.c_char_p)],
+	'InitEvent':       [HCAM, HANDLE, INT],
+	'EnableEvent':     [HCAM, INT],
+	'DisableEvent':    [HCAM, INT],
+	'ExitEvent':       [HCAM, INT],
+	'WaitEvent':       [HCAM, INT, INT],
+	'FreezeVideo':     [HCAM, INT],
+	'CaptureVideo':    [HCAM, INT],
+	'StopLiveVideo':   [HCAM, INT],
+	'SetImageSize':    [HCAM, INT, INT],
+	'SetImagePos':     [HCAM, INT, INT],
+	'SetAOI':          [HCAM, INT, c_int_p, c_int_p, c_int_p, c_int_p],
+	'SetColorMode':    [HCAM, INT],
+	'SetPixelClock':   [HCAM, INT],
+	'SetHardwareGain': [HCAM, INT, INT, INT, INT],
+	'SetGainBoost':    [HCAM, INT],
+	'SetGamma':        [HCAM, INT],
+	'SetExposureTime': [HCAM, ctypes.c_double, ctypes.POINTER(ctypes.c_double)],
+	'SetFrameRate':    [HCAM, ctypes.c_double, ctypes.POINTER(ctypes.c_double)],
+	'SetSubSampling':  [HCAM, INT],
+}
+
+def BIND(lib):
+	"""
+	Look up every function in PROTOTYPES in "lib" once, declare its
+	argument and return types, and return them in a dict by name.
+	Functions the library doesn't export are left out.
+	"""
+	funcs = {}
+	for name, argtypes in PROTOTYPES.items():
+		try:
+			func = getattr(lib, 'is_' + name)
+		except AttributeError:
+			continue
+		if not isinstance(func, ctypes._CFuncPtr):
+			# plain python backend: wrap it so it is called just like the dll
+			func = ctypes.CFUNCTYPE(INT, *argtypes)(func)
+		func.argtypes = argtypes
+		func.restype = INT
+		funcs[name] = func
+	return funcs
+	
+# the library and its bound functions; nothing is loaded until the first camera()
+libuc480 = None
+libfuncs = {}
+
+def SetBackend(lib):
+	"""
+	Send all driver calls to "lib" from now on: a ctypes library, or an
+	object with is_* methods such as uc480_sim.SimLibrary.
+	"""
+	global libuc480, libfuncs
+	libuc480 = lib
+	libfuncs = BIND(lib)
+	
+def LoadLibrary():
+	"""
+	Load and bind the driver dll. UC480_BACKEND=sim picks the simulated
+	camera instead, and UC480_LIBRARY loads some other library in its place.
+	"""
+	if os.environ.get('UC480_BACKEND') == 'sim':
+		import uc480_sim
+		SetBackend(uc480_sim.SimLibrary())
+		return
+	lib = os.environ.get('UC480_LIBRARY')
+	if lib is None and os.name=='nt':
+		# imported as another name: "import ctypes.util" would make ctypes
+		# local to the whole function
+		import ctypes.util as ctypes_util
+		lib = ctypes_util.find_library('uc480_64')
+	if lib is None:
+		raise OSError('uc480.dll not found')
+	SetBackend(ctypes.cdll.LoadLibrary(lib))
+	
+	
+def GetCameraList():
+	"""
+	Cameras attached to this machine, as a list of UC480_CAMERA_INFO.
+	dwCameraID is what to pass to camera() to open that one.
+	"""
+	if libuc480 is None:
+		LoadLibrary()
+	# first ask how many there are, then get them all
+	count = UC480_CAMERA_LIST(1)()
+	CALL("GetCameraList",ctypes.byref(count))
+	cameras = UC480_CAMERA_LIST(max(count.dwCount,1))()
+	cameras.dwCount = count.dwCount
+	CALL("GetCameraList",ctypes.byref(cameras))
+	return list(cameras.uci[:cameras.dwCount])
+	
 def CALL(name, *args):
 	"""
 	Calls libuc480 function "name" and arguments "args".
 	"""
-	funcname = 'is_' + name
-	if (verbose):
+	if verbose:
 		print name
-	func = getattr(libuc480, funcname)
-	new_args = []
-	for a in args:		
-		if isinstance (a, unicode):
-			print name, 'argument',a, 'is unicode'
-			new_args.append (str (a))
-		else:
-			new_args.append (a)
-	r = func(*new_args)
-	if (verbose):
+		r = libfuncs[name](*args)
 		print r
-  # r = CHK(r, funcname, *new_args)
-	return r
+		return r
+	return libfuncs[name](*args)
+
 
+# one captured frame: driver frame number, device timestamp (s) and pixels
+Frame = collections.namedtuple('Frame','number time image')
+
+# what FrameQueue.put does when the queue is full
+DROP_OLDEST = 'drop-oldest'
+BLOCK = 'block'
+
+class FrameQueue(object):
+	'''Bounded frame queue between the acquisition thread and its consumers'''
+	def __init__(self,size=8,policy=DROP_OLDEST):
+		self.size = size
+		self.policy = policy
+		self.frames = collections.deque()
+		self.cond = threading.Condition()
+		self.closed = False
+		# occupancy statistics
+		self.puts = 0
+		self.gets = 0
+		self.dropped = 0
+		self.maxDepth = 0
+		self.depthSum = 0
+		
+	def put(self,frame):
+		'''Add a frame; returns False if the queue was closed'''
+		with self.cond:
+			while len(self.frames) >= self.size and not self.closed:
+				if self.policy == DROP_OLDEST:
+					self.frames.popleft()
+					self.dropped += 1
+				else:
+					self.cond.wait(0.1)
+			if self.closed:
+				return False
+			self.frames.append(frame)
+			self.puts += 1
+			self.depthSum += len(self.frames)
+			self.maxDepth = max(self.maxDepth,len(self.frames))
+			self.cond.notify_all()
+			return True
+			
+	def get(self,timeout=None):
+		'''Oldest frame in the queue, or None on timeout or close'''
+		with self.cond:
+			if not self.frames and not self.closed:
+				self.cond.wait(timeout)
+			if not self.frames:
+				return None
+			frame = self.frames.popleft()
+			self.gets += 1
+			self.cond.notify_all()
+			return frame
+			
+	def close(self):
+		with self.cond:
+			self.closed = True
+			self.cond.notify_all()
+			
+	def __len__(self):
+		return len(self.frames)
+		
+	def stats(self):
+		return {'puts': self.puts, 'gets': self.gets, 'dropped': self.dropped,
+				'depth': len(self.frames), 'maxDepth': self.maxDepth,
+				'meanDepth': self.depthSum/float(max(self.puts,1))}
+				
 		
 class camera(HCAM):
 	def __init__(self,camera_id=0):
-		#self.id = camera_id
-		HCAM.__init__(self,0)
+		'''Open camera camera_id (see GetCameraList), or 0 for the first free one'''
+		if libuc480 is None:
+			LoadLibrary()
+		# the handle going in says which camera to open, coming out it's ours
+		HCAM.__init__(self,camera_id)
 		self.h = CALL('InitCamera',ctypes.byref(self),HWND(0))
+		self.cameraId = self.value
 		self.width = 1024
 		self.height = 768		
 		self.data = np.zeros((self.height,self.width),dtype=np.uint8)
 		self.fps = 0
+		self.targetFps = 0
+		self.event = None
+		self.hEvent = None
+		# sequence (ring) buffers, as (image,id) pairs, and how far behind we fell
+		self.seq = []
+		self.seqIds = {}
+		self.lastFrame = None
+		self.overruns = 0
+		# per-frame info block, filled in place for every frame we read
+		self.info = UC480_IMAGE_INFO()
+		self.frame = 0
+		self.deviceTime = 0.0
+		self.systemTime = None
+		self.framesRead = 0
+		self.dropped = 0
+		self.firstDeviceTime = None
+		# where GetSensorRate measures from, restarted when the readout changes
+		self.rateStart = None
+		# numpy views straight onto each driver buffer, by buffer id
+		self.views = {}
+		# background acquisition
+		self.queue = None
+		self.thread = None
+		# buffers can be swapped under the acquisition thread (see SetAOI)
+		self.bufLock = threading.RLock()
+		self.locked = False
+		# readout area, as ((x,y),(width,height)) on the sensor
+		self.sensorWidth = self.width
+		self.sensorHeight = self.height
+		self.aoi = ((0,0),(self.width,self.height))
+		self.bitpixel = 8
+		self.colorMode = IS_SET_CM_Y8
+		self.live = False
+		# last gain (-1 is auto) and exposure (ms) we set
+		self.gain = -1
+		self.exposure = 0.0
+		# called with every Frame on the acquisition thread, before the queue;
+		# for consumers that must see every frame, like raw recording
+		self.listeners = []
 		return None
 		
 	def ExitCamera(self):
@@ -243,17 +424,101 @@ class camera(HCAM):
 		CALL('AllocImageMem',self,c_int(width),c_int(height),c_int(bitpixel),ctypes.byref(self.image),ctypes.byref(self.id))
 		if (verbose):
 			print self.id
+		self.bitpixel = bitpixel
+		# driver lines are padded out to a multiple of 4 bytes
+		pitch = (width*bitpixel/8 + 3)/4*4
+		buf = (ctypes.c_ubyte*(pitch*height)).from_address(ctypes.addressof(self.image.contents))
+		self.views[self.id.value] = ctypeslib.as_array(buf).reshape(height,pitch)[:,:width*bitpixel/8]
 	
+	def AllocSequence(self,count=4,width=1024,height=768,bitpixel=8):
+		'''Allocate count driver buffers and register them as a capture ring'''
+		self.seq = []
+		self.seqIds = {}
+		for i in range(count):
+			self.AllocImageMem(width,height,bitpixel)
+			CALL('AddToSequence',self,self.image,self.id)
+			self.seq.append((self.image,self.id))
+			self.seqIds[ctypes.addressof(self.image.contents)] = self.id
+		# a new ring's frames don't follow on from the old one's; the
+		# counters keep going (see ResetCounters)
+		self.lastFrame = None
+		
+	def ResetCounters(self):
+		'''Start counting frames read, dropped and overrun from here'''
+		self.lastFrame = None
+		self.overruns = 0
+		self.framesRead = 0
+		self.dropped = 0
+		self.firstDeviceTime = None
+		
 	def FreeImageMem (self):
-		CALL("FreeImageMem",self,self.image,self.id)
+		if self.seq:
+			CALL("ClearSequence",self)
+			for image,id in self.seq:
+				CALL("FreeImageMem",self,image,id)
+			self.seq = []
+			self.seqIds = {}
+		else:
+			CALL("FreeImageMem",self,self.image,self.id)
+		self.views = {}
 		
 	def FreezeVideo(self,wait=IS_WAIT):
 		CALL("FreezeVideo",self,INT(wait))
 		
+	def LockSeqBuf(self):
+		'''Point self.image/self.id at the newest finished sequence buffer and
+		lock it, so the driver skips it while we read'''
+		num = c_int()
+		mem = c_char_p()
+		last = c_char_p()
+		CALL("GetActSeqBuf",self,ctypes.byref(num),ctypes.byref(mem),ctypes.byref(last))
+		if not last or ctypes.addressof(last.contents) not in self.seqIds:
+			# nothing captured into this ring yet
+			return False
+		self.image = last
+		self.id = self.seqIds[ctypes.addressof(last.contents)]
+		CALL("LockSeqBuf",self,c_int(IS_IGNORE_PARAMETER),self.image)
+		return True
+		
+	def UnlockSeqBuf(self):
+		CALL("UnlockSeqBuf",self,c_int(IS_IGNORE_PARAMETER),self.image)
+		
+	def LockImage(self):
+		'''Return a numpy view onto the current driver buffer, with no copy.
+		In sequence mode the buffer stays locked until UnlockImage().
+		Returns None if no frame has arrived yet.'''
+		self.bufLock.acquire()
+		if self.seq and not self.LockSeqBuf():
+			self.bufLock.release()
+			return None
+		self.locked = True
+		self.UpdateFrameInfo()
+		return self.views[self.id.value]
+		
+	def UnlockImage(self):
+		'''Hand the buffer from LockImage() back to the driver. Any view of it
+		must not be used after this.'''
+		if not self.locked:
+			return
+		if self.seq:
+			self.UnlockSeqBuf()
+		self.locked = False
+		self.bufLock.release()
+		
+	@contextlib.contextmanager
+	def Image(self):
+		'''with camera.Image() as img: ... -- zero-copy view, released on exit'''
+		img = self.LockImage()
+		try:
+			yield img
+		finally:
+			self.UnlockImage()
+		
 	def CopyImageMem(self):
-                #CALL("LockSeqBuf",self,-1,self.image)
+		if self.LockImage() is None:
+			return
 		r = CALL("CopyImageMem",self,self.image,self.id,self.data.ctypes.data)
-		#CALL("UnlockSeqBuf",self,-1,self.image)
+		self.UnlockImage()
 		if r == -1:
 			self.GetError()
 			print self.err
@@ -265,10 +530,107 @@ class camera(HCAM):
 		self.errMessage = ctypes.c_char_p()
 		CALL("GetError",self,ctypes.byref(self.err),ctypes.byref(self.errMessage))
 		
+	def InitEvent(self,which=IS_SET_EVENT_FRAME):
+		'''Enable a driver event (default: new frame) so we can block on it'''
+		if 'WaitEvent' not in libfuncs:
+			# older windows driver, event is signalled on a win32 handle
+			self.hEvent = ctypes.windll.kernel32.CreateEventA(None,False,False,None)
+			CALL("InitEvent",self,HANDLE(self.hEvent),c_int(which))
+		CALL("EnableEvent",self,c_int(which))
+		self.event = which
+		
+	def WaitForNextFrame(self,timeout=1000):
+		'''Block until the next frame arrives or timeout (in ms) runs out.
+		Returns True if a new frame is ready.'''
+		if self.event is None:
+			self.InitEvent()
+		if self.hEvent is None:
+			return CALL("WaitEvent",self,c_int(self.event),c_int(timeout)) == IS_SUCCESS
+		return ctypes.windll.kernel32.WaitForSingleObject(HANDLE(self.hEvent),DWORD(timeout)) == WAIT_OBJECT_0
+		
+	def ExitEvent(self):
+		if self.event is None:
+			return
+		CALL("DisableEvent",self,c_int(self.event))
+		if self.hEvent is not None:
+			CALL("ExitEvent",self,c_int(self.event))
+			ctypes.windll.kernel32.CloseHandle(HANDLE(self.hEvent))
+			self.hEvent = None
+		self.event = None
+		
+	def StartAcquisition(self,size=8,policy=DROP_OLDEST):
+		'''Start a thread that copies every new frame into self.queue'''
+		self.queue = FrameQueue(size,policy)
+		self.InitEvent()
+		self.thread = threading.Thread(target=self.Acquire,name='uc480 acquisition')
+		self.thread.daemon = True
+		self.thread.start()
+		
+	def Acquire(self):
+		'''Acquisition thread body, runs until the queue is closed'''
+		while not self.queue.closed:
+			if not self.WaitForNextFrame(100):
+				continue
+			with self.Image() as img:
+				if img is None:
+					continue
+				frame = Frame(self.frame,self.deviceTime,img.copy())
+			for listener in list(self.listeners):
+				listener(frame)
+			self.queue.put(frame)
+			
+	def StopAcquisition(self):
+		if self.thread is None:
+			return
+		self.queue.close()
+		self.thread.join()
+		self.thread = None
+		self.ExitEvent()
+		
+	def GetImageInfo(self):
+		'''Fill in self.info for the current buffer and return it'''
+		CALL("GetImageInfo",self,self.id,ctypes.byref(self.info),ctypes.sizeof(self.info))
+		return self.info
+		
 	def GetFrameCount(self):
-	        vals = np.zeros(10,dtype=np.uint64)
-	        CALL("GetImageInfo",self,self.id,vals.ctypes.data,76)
-	        return vals[6]
+		return self.GetImageInfo().u64FrameNumber
+		
+	def UpdateFrameInfo(self):
+		'''Read frame number and timestamps of the current buffer, and count
+		any frames we never saw since the last read'''
+		info = self.GetImageInfo()
+		self.frame = info.u64FrameNumber
+		self.deviceTime = info.u64TimestampDevice*1e-7
+		t = info.TimestampSystem
+		self.systemTime = (t.wYear,t.wMonth,t.wDay,t.wHour,t.wMinute,t.wSecond,t.wMilliseconds)
+		
+		if self.lastFrame is not None and self.frame > self.lastFrame:
+			gap = self.frame - self.lastFrame
+			self.dropped += gap - 1
+			# anything more than a full ring since the last read got overwritten
+			if self.seq:
+				self.overruns += max(gap - len(self.seq), 0)
+		if self.lastFrame != self.frame:
+			self.framesRead += 1
+		if self.firstDeviceTime is None:
+			self.firstDeviceTime = self.deviceTime
+		if self.rateStart is None:
+			self.rateStart = (self.frame,self.deviceTime)
+		self.lastFrame = self.frame
+		
+	def GetThroughput(self):
+		'''Frames actually read per second of device time'''
+		if self.firstDeviceTime is None or self.deviceTime <= self.firstDeviceTime:
+			return 0.0
+		return (self.framesRead-1)/(self.deviceTime-self.firstDeviceTime)
+		
+	def GetSensorRate(self):
+		'''Frames the sensor delivered per second of device time, counting the
+		ones we dropped, since the readout last changed; falls back on the
+		rate the driver set'''
+		if self.rateStart is None or self.deviceTime <= self.rateStart[1]:
+			return float(self.fps)
+		return (self.frame-self.rateStart[0])/(self.deviceTime-self.rateStart[1])
 		
 	def SetImageMem (self):
 		CALL("SetImageMem",self,self.image,self.id)
@@ -281,17 +643,59 @@ class camera(HCAM):
 	def SetImagePos(self,x=0,y=0):
 		CALL("SetImagePos",self,c_int(x),c_int(y))
 		
+	def SetAOI(self,x=0,y=0,width=None,height=None):
+		'''Read out only part of the sensor. Moving the area is cheap; resizing
+		it reallocates the image buffers and asks for the frame rate again,
+		which the driver can now set much higher for small areas.
+		Returns True if anything changed.'''
+		if width is None:
+			width,height = self.sensorWidth,self.sensorHeight
+		# the sensor wants even, 4-pixel aligned areas
+		x,y = x - x%4, y - y%2
+		width,height = width - width%4, height - height%2
+		if ((x,y),(width,height)) == self.aoi:
+			return False
+		
+		with self.bufLock:
+			if (width,height) != (self.width,self.height):
+				live = self.live
+				if live:
+					self.StopLiveVideo()
+				depth = len(self.seq)
+				self.FreeImageMem()
+				self.width,self.height = width,height
+				self.data = np.zeros((height,width),dtype=np.uint8)
+				if depth:
+					self.AllocSequence(depth,width,height,self.bitpixel)
+				else:
+					self.AllocImageMem(width,height,self.bitpixel)
+					self.SetImageMem()
+				rect = [c_int(v) for v in (x,y,width,height)]
+				CALL("SetAOI",self,c_int(IS_SET_IMAGE_AOI),*[ctypes.byref(v) for v in rect])
+				if self.fps:
+					self.SetFrameRate(self.targetFps)
+				self.rateStart = None
+				if live:
+					self.CaptureVideo()
+			else:
+				self.SetImagePos(x,y)
+			self.aoi = ((x,y),(width,height))
+		return True
+		
 	def CaptureVideo(self,wait=IS_DONT_WAIT):
 		CALL("CaptureVideo",self,c_int(wait))
+		self.live = True
 		
 	def SetColorMode(self,color_mode=IS_SET_CM_Y8):
 		CALL("SetColorMode",self,c_int(color_mode))
+		self.colorMode = color_mode
 		
 	def SetPixelClock(self,pixel_clock=30):
 		CALL("SetPixelClock",self,c_int(pixel_clock))
 		
 	def SetGain(self,gain=IS_SET_ENABLE_AUTO_GAIN):
 		CALL("SetHardwareGain",self,c_int(gain),c_int(IS_IGNORE_PARAMETER),c_int(IS_IGNORE_PARAMETER),c_int(IS_IGNORE_PARAMETER))
+		self.gain = -1 if gain == IS_SET_ENABLE_AUTO_GAIN else gain
 			
 	def SetGainBoost(self,boost=True):
 		if boost:
@@ -305,12 +709,15 @@ class camera(HCAM):
 	def SetExposureTime(self,time=0.0):
 		newTime = ctypes.c_double()
 		CALL("SetExposureTime",self,ctypes.c_double(time),ctypes.pointer(newTime))
+		self.exposure = newTime.value
 		return newTime.value
 		
 	def SetFrameRate(self,fps):
+		self.targetFps = fps
 		newFPS = ctypes.c_double()
 		CALL("SetFrameRate",self,ctypes.c_double(fps),ctypes.pointer(newFPS))
 		self.fps = newFPS.value
+		self.rateStart = None
 		return newFPS.value
 		
 	def SetSubSampling(self,mode=IS_SUBSAMPLING_DISABLE):
@@ -318,6 +725,7 @@ class camera(HCAM):
 		
 	def StopLiveVideo(self,wait=IS_WAIT):
 		CALL("StopLiveVideo",self,c_int(wait))
+		self.live = False
 		
 	def ExitCamera (self):
 		CALL("ExitCamera",self)
\ No newline at end of file
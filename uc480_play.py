@@ -0,0 +1,243 @@
+'''Recordings played back as a camera, through the simulated libuc480.
+
+A PlayCamera stands in for the sensor with frames from a file, so
+uc480.camera and everything downstream of it run unchanged on a recording:
+
+	import uc480, uc480_play
+	player = uc480_play.PlayLibrary(['2016-03-01.004.raw'])
+	uc480.SetBackend(player)
+	camera = uc480.camera()
+
+Frames are read ahead on their own thread. Playback goes at the recorded
+timestamps (times speed), as fast as frames can be read (speed 0), or a
+frame at a time with Step() while paused.
+'''
+
+import os
+import threading
+import time
+import numpy as np
+
+import uc480
+import uc480_sim
+from uc480_h import *
+
+
+class RecordingSource(object):
+	'''Random access to the frames of a recording, with their timestamps.
+	Takes our raw recordings and .ucs stacks, .npy stacks, or any video
+	OpenCV can read (at its nominal frame rate, and in gray).'''
+	def __init__(self,fname,fps=20.0):
+		self.fname = fname
+		self.cap = None
+		if fname.endswith('.raw') and os.path.exists(fname + '.idx'):
+			import recorder
+			self.frames,index = recorder.readRaw(fname)
+			self.times = self.Zeroed(index['time'])
+		elif fname.endswith('.ucs'):
+			import recorder
+			self.frames = recorder.StackReader(fname)
+			self.times = self.Zeroed(self.frames.index['time'])
+		elif fname.endswith('.npy'):
+			self.frames = np.load(fname,mmap_mode='r')
+			self.times = np.arange(len(self.frames))/float(fps)
+		else:
+			import cv2
+			self.cap = cv2.VideoCapture(fname)
+			if not self.cap.isOpened():
+				raise IOError('cannot open %s' % fname)
+			fps = self.cap.get(cv2.cv.CV_CAP_PROP_FPS) or fps
+			count = int(self.cap.get(cv2.cv.CV_CAP_PROP_FRAME_COUNT))
+			self.times = np.arange(count)/float(fps)
+			self.frames = None
+			self.next = 0
+		self.count = len(self.times)
+		if self.count == 0:
+			raise IOError('no frames in %s' % fname)
+		self.shape = self.Read(0).shape
+
+	def Zeroed(self,times):
+		'''Timestamps counted from the first frame'''
+		return times - times[0] if len(times) else times
+
+	def Read(self,i):
+		if self.cap is None:
+			# a copy, so memory-mapped frames get read from disk here
+			return np.array(self.frames[i])
+		import cv2
+		if i != self.next:
+			# intra-only codecs (mjpeg, ffv1) seek exactly; others to a keyframe
+			self.cap.set(cv2.cv.CV_CAP_PROP_POS_FRAMES,i)
+		ok,img = self.cap.read()
+		self.next = i+1
+		if not ok:
+			return None
+		if img.ndim == 3:
+			img = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+		return img
+
+	def Find(self,t):
+		'''Index of the first frame at or after t seconds in'''
+		return min(int(np.searchsorted(self.times,t)),self.count-1)
+
+	@property
+	def fps(self):
+		if self.count < 2 or self.times[-1] <= 0:
+			return 20.0
+		return (self.count-1)/self.times[-1]
+
+
+class PlayCamera(uc480_sim.SimCamera):
+	'''A simulated camera whose sensor plays back a recording.
+
+	speed:    1 for real time, 2 for double speed..., 0 for as fast as
+	          frames can be read
+	loop:     start over at the end, rather than stop
+	prefetch: how many frames to read ahead
+	Other keyword arguments go to SimCamera (dropRate, seed, serial).
+	'''
+	def __init__(self,fname,speed=1.0,loop=True,prefetch=32,**kwargs):
+		self.source = RecordingSource(fname)
+		height,width = self.source.shape
+		self.speed = speed
+		self.loop = loop
+		self.paused = False
+		self.steps = 0
+		# index of the frame last delivered
+		self.position = -1
+		# read-ahead: (generation, index, image); a seek starts a new generation
+		self.prefetch = uc480.FrameQueue(prefetch,uc480.BLOCK)
+		self.generation = 0
+		self.readFrom = 0
+		self.control = threading.Condition()
+		self.reader = None
+		uc480_sim.SimCamera.__init__(self,self.source.fps,width,height,'flat',**kwargs)
+
+	def MakeFrames(self,noise,rng,count=16):
+		return None
+
+	# ----- read-ahead thread -----
+
+	def ReadAhead(self):
+		while self.running:
+			with self.control:
+				gen,i = self.generation,self.readFrom
+				self.readFrom = i+1
+			if i >= self.source.count:
+				if not self.loop:
+					time.sleep(0.05)
+					with self.control:
+						if self.generation == gen:
+							self.readFrom = i
+					continue
+				with self.control:
+					if self.generation == gen:
+						self.readFrom = 1
+				i = 0
+			img = self.source.Read(i)
+			if img is not None:
+				self.prefetch.put((gen,i,img))
+
+	# ----- sensor thread -----
+
+	def Run(self):
+		# playback clock: recorded time base is shown at wall time start
+		start = None
+		while self.running:
+			with self.control:
+				while self.paused and not self.steps and self.running:
+					self.control.wait(0.1)
+					start = None
+				if not self.running:
+					break
+			item = self.prefetch.get(0.1)
+			if item is None:
+				continue
+			gen,i,img = item
+			with self.control:
+				if gen != self.generation:
+					continue
+				if self.steps:
+					self.steps -= 1
+				stepping = self.paused
+			t = self.source.times[i]
+			if start is None or stepping or i <= self.position or not self.speed:
+				# (re)start the clock: after a pause, seek, step or wrap
+				start = (time.time(),t)
+			else:
+				delay = start[0] + (t-start[1])/self.speed - time.time()
+				if delay > 0:
+					time.sleep(delay)
+			self.position = i
+			self.Expose(img)
+
+	def Start(self):
+		if self.running:
+			return
+		uc480_sim.SimCamera.Start(self)
+		self.reader = threading.Thread(target=self.ReadAhead,name='uc480 play reader')
+		self.reader.daemon = True
+		self.reader.start()
+
+	def Stop(self):
+		uc480_sim.SimCamera.Stop(self)
+		if self.reader is not None:
+			# let a reader blocked on a full queue finish its put
+			while self.reader.is_alive():
+				self.prefetch.get(0.01)
+			self.reader = None
+
+	# ----- playback controls -----
+
+	def Play(self):
+		with self.control:
+			self.paused = False
+			self.control.notify_all()
+
+	def Pause(self):
+		with self.control:
+			self.paused = True
+
+	def Step(self,count=1):
+		'''While paused, deliver the next count frames'''
+		with self.control:
+			self.steps += count
+			self.control.notify_all()
+
+	def Seek(self,i):
+		'''Carry on playing from frame i of the recording'''
+		with self.control:
+			self.readFrom = max(0,min(i,self.source.count-1))
+			self.generation += 1
+			self.position = -1
+		# throw away what was read ahead from the old place
+		while self.prefetch.get(0) is not None:
+			pass
+
+	def SeekTime(self,t):
+		'''Carry on playing from t seconds into the recording'''
+		self.Seek(self.source.Find(t))
+
+	def SetSpeed(self,speed):
+		self.speed = speed
+
+	def Status(self):
+		speed = '%gx' % self.speed if self.speed else 'max'
+		return '%s %d/%d %s' % ('paused' if self.paused else 'playing',
+								 self.position+1,self.source.count,speed)
+
+	# ----- the is_* calls -----
+
+	def is_SetFrameRate(self,hCam,fps,pNew):
+		# the recording sets the pace
+		pNew[0] = self.source.fps*self.speed if self.speed else 0.0
+		return IS_SUCCESS
+
+
+class PlayLibrary(uc480_sim.SimLibrary):
+	'''Stand-in for the uc480 dll with a PlayCamera for each recording.
+	Keyword arguments are passed on to each PlayCamera.'''
+	def __init__(self,fnames,**kwargs):
+		self.cameras = [PlayCamera(fname,serial='40030%05d' % (i+1),**kwargs)
+						for i,fname in enumerate(fnames)]
+		self.open = {}
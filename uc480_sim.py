@@ -0,0 +1,429 @@
+'''Simulated libuc480, for running and benchmarking without the camera.
+
+Implements the is_* calls uc480.camera uses, on plain memory, with a thread
+standing in for the sensor. Use it with
+
+	import uc480, uc480_sim
+	uc480.SetBackend(uc480_sim.SimLibrary(fps=50))
+
+or set UC480_BACKEND=sim before importing uc480. SimLibrary(cameras=3) has
+three cameras attached.
+'''
+
+import ctypes
+import datetime
+import os
+import random
+import threading
+import time
+import numpy as np
+
+import uc480
+from uc480_h import *
+
+
+def LoadFrames(fname,width=1024,height=768):
+	'''Load recorded frames to replay, as an (n,height,width) uint8 array.
+	Takes a .npy stack, a raw recording (or any raw 8-bit frames back to
+	back), a compressed .ucs stack, or anything OpenCV can read.'''
+	if fname.endswith('.npy'):
+		return np.load(fname,mmap_mode='r')
+	if fname.endswith('.raw'):
+		if os.path.exists(fname + '.idx'):
+			# our own raw recording, which knows its size
+			import recorder
+			return recorder.readRaw(fname)[0]
+		return np.memmap(fname,dtype=np.uint8,mode='r').reshape(-1,height,width)
+	if fname.endswith('.ucs'):
+		import recorder
+		stack = recorder.StackReader(fname)
+		return np.array([stack[i] for i in range(len(stack))])
+	import cv2
+	cap = cv2.VideoCapture(fname)
+	frames = []
+	while True:
+		ok,img = cap.read()
+		if not ok:
+			break
+		if img.ndim == 3:
+			img = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+		frames.append(img)
+	cap.release()
+	return np.array(frames)
+
+
+class SimCamera(object):
+	'''One simulated camera; the is_* calls for an open handle land here.
+
+	fps, width, height: starting frame rate and sensor size
+	pattern:  'gradient', 'spot' (gradient plus a moving bright spot) or 'flat'
+	noise:    std dev of gaussian pixel noise, in counts
+	dropRate: fraction of frames the "sensor" takes but never delivers
+	replay:   file of recorded frames to play back instead of a pattern
+	maxFps:   fastest full-sensor readout, if any; smaller AOIs go faster
+	'''
+	def __init__(self,fps=20,width=1024,height=768,pattern='spot',noise=4.0,
+				 dropRate=0.0,replay=None,seed=0,maxFps=None,serial='4002000000'):
+		self.serial = serial
+		self.fps = float(fps)
+		self.maxFps = maxFps
+		self.width = width
+		self.height = height
+		self.pattern = pattern
+		self.dropRate = dropRate
+		self.random = random.Random(seed)
+		self.exposure = 1000.0/self.fps
+
+		if replay is not None:
+			self.frames = LoadFrames(replay,width,height)
+			self.height,self.width = self.frames.shape[1:3]
+		else:
+			self.frames = self.MakeFrames(noise,np.random.RandomState(seed))
+		# readout area on the sensor
+		self.aoi = [0,0,self.width,self.height]
+
+		# image memory by id, as (ctypes buffer, numpy view)
+		self.mem = {}
+		self.nextId = 1
+		self.active = None
+		self.seq = []
+		self.locked = set()
+		self.lastBuf = None
+		# frame number and timestamps of whatever was last written to each buffer
+		self.info = {}
+
+		self.frameCount = 0
+		self.delivered = 0
+		# device clock starts when the "camera" is opened
+		self.t0 = time.time()
+		self.cond = threading.Condition()
+		self.thread = None
+		self.running = False
+
+	def MakeFrames(self,noise,rng,count=16):
+		'''A small bank of noisy frames to cycle through'''
+		y,x = np.mgrid[0:self.height,0:self.width]
+		if self.pattern == 'flat':
+			base = np.full((self.height,self.width),128.0)
+		else:
+			base = 32 + 160.0*x/self.width
+		frames = np.empty((count,self.height,self.width),np.uint8)
+		for i in range(count):
+			frames[i] = np.clip(base + rng.normal(0,noise,base.shape),0,255) if noise else base
+		return frames
+
+	# ----- sensor thread -----
+
+	def Run(self):
+		due = time.time()
+		while self.running:
+			# sleep until this frame is due, so timing doesn't drift
+			due += 1/self.fps
+			delay = due - time.time()
+			if delay > 0:
+				time.sleep(delay)
+			self.Expose()
+
+	def Expose(self,img=None):
+		'''Take one frame (img, or the next of our own) and write it to the
+		next free buffer'''
+		with self.cond:
+			self.frameCount += 1
+			if self.dropRate and self.random.random() < self.dropRate:
+				return
+			id = self.NextBuffer()
+			if id is None:
+				return
+			view = self.mem[id][1]
+			x0,y0 = self.aoi[:2]
+			if img is None:
+				img = self.frames[self.frameCount % len(self.frames)]
+			src = img[y0:,x0:]
+			h = min(view.shape[0],src.shape[0])
+			w = min(view.shape[1],src.shape[1])
+			view[:h,:w] = src[:h,:w]
+			if self.pattern == 'spot':
+				# the spot moves over the whole sensor, we only see it inside the AOI
+				x = int((0.5 + 0.4*np.sin(0.05*self.frameCount))*(self.width-16)) - x0
+				y = int((0.5 + 0.4*np.cos(0.03*self.frameCount))*(self.height-16)) - y0
+				view[max(y,0):max(y+16,0),max(x,0):max(x+16,0)] = 255
+			self.info[id] = (self.frameCount,time.time())
+			self.lastBuf = id
+			self.delivered = self.frameCount
+			self.cond.notify_all()
+
+	def NextBuffer(self):
+		if not self.seq:
+			return self.active
+		# go round the ring, skipping anything locked
+		i = self.seq.index(self.lastBuf)+1 if self.lastBuf in self.seq else 0
+		for k in range(len(self.seq)):
+			id = self.seq[(i+k) % len(self.seq)]
+			if id not in self.locked:
+				return id
+		return None
+
+	def Start(self):
+		if self.running:
+			return
+		self.running = True
+		self.thread = threading.Thread(target=self.Run,name='uc480 sim sensor')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def Stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+	def Address(self,id):
+		return ctypes.addressof(self.mem[id][0])
+
+	def Id(self,ptr):
+		addr = ctypes.addressof(ptr.contents)
+		for id in self.mem:
+			if self.Address(id) == addr:
+				return id
+		return None
+
+	# ----- the is_* calls -----
+
+	def is_ExitCamera(self,hCam):
+		self.Stop()
+		return IS_SUCCESS
+
+	def is_SaveImage(self,hCam,fname):
+		return IS_SUCCESS
+
+	def is_AllocImageMem(self,hCam,width,height,bitpixel,ppcMem,pid):
+		pitch = (width*bitpixel/8 + 3)/4*4
+		buf = (ctypes.c_byte*(pitch*height))()
+		view = np.frombuffer(buf,np.uint8).reshape(height,pitch)[:,:width*bitpixel/8]
+		id = self.nextId
+		self.nextId += 1
+		self.mem[id] = (buf,view)
+		ppcMem[0] = ctypes.cast(buf,uc480.c_char_p)
+		pid[0] = id
+		return IS_SUCCESS
+
+	def is_FreeImageMem(self,hCam,pcMem,id):
+		with self.cond:
+			self.mem.pop(id,None)
+			self.info.pop(id,None)
+			if self.active == id:
+				self.active = None
+			if self.lastBuf == id:
+				self.lastBuf = None
+		return IS_SUCCESS
+
+	def is_SetImageMem(self,hCam,pcMem,id):
+		self.active = id
+		return IS_SUCCESS
+
+	def is_AddToSequence(self,hCam,pcMem,id):
+		with self.cond:
+			self.seq.append(id)
+		return IS_SUCCESS
+
+	def is_ClearSequence(self,hCam):
+		with self.cond:
+			self.seq = []
+			self.locked.clear()
+		return IS_SUCCESS
+
+	def is_GetActSeqBuf(self,hCam,pnNum,ppcMem,ppcMemLast):
+		with self.cond:
+			if self.lastBuf is None or not self.seq:
+				return IS_SEQUENCE_LIST_EMPTY
+			last = ctypes.cast(self.Address(self.lastBuf),uc480.c_char_p)
+			pnNum[0] = self.seq.index(self.lastBuf)+1
+			ppcMem[0] = last
+			ppcMemLast[0] = last
+		return IS_SUCCESS
+
+	def is_LockSeqBuf(self,hCam,nNum,pcMem):
+		with self.cond:
+			self.locked.add(self.Id(pcMem))
+		return IS_SUCCESS
+
+	def is_UnlockSeqBuf(self,hCam,nNum,pcMem):
+		with self.cond:
+			self.locked.discard(self.Id(pcMem))
+		return IS_SUCCESS
+
+	def is_CopyImageMem(self,hCam,pcSource,id,pcDest):
+		if id not in self.mem:
+			return IS_INVALID_MEMORY_POINTER
+		view = self.mem[id][1]
+		ctypes.memmove(pcDest,self.Address(id),view.shape[0]*view.shape[1])
+		return IS_SUCCESS
+
+	def is_GetImageInfo(self,hCam,id,pInfo,size):
+		if id not in self.info:
+			return IS_NO_SUCCESS
+		frame,t = self.info[id]
+		info = pInfo.contents
+		info.u64FrameNumber = frame
+		info.u64TimestampDevice = int((t-self.t0)*1e7)
+		d = datetime.datetime.fromtimestamp(t)
+		ts = info.TimestampSystem
+		ts.wYear,ts.wMonth,ts.wDay = d.year,d.month,d.day
+		ts.wHour,ts.wMinute,ts.wSecond = d.hour,d.minute,d.second
+		ts.wMilliseconds = d.microsecond/1000
+		view = self.mem[id][1]
+		info.dwImageHeight,info.dwImageWidth = view.shape
+		info.dwImageBuffers = len(self.seq) or 1
+		info.dwImageBuffersInUse = len(self.locked)
+		return IS_SUCCESS
+
+	def is_GetError(self,hCam,pErr,ppcErr):
+		pErr[0] = 0
+		return IS_SUCCESS
+
+	def is_InitEvent(self,hCam,hEvent,which):
+		return IS_SUCCESS
+
+	def is_EnableEvent(self,hCam,which):
+		return IS_SUCCESS
+
+	def is_DisableEvent(self,hCam,which):
+		return IS_SUCCESS
+
+	def is_ExitEvent(self,hCam,which):
+		return IS_SUCCESS
+
+	def is_WaitEvent(self,hCam,which,timeout):
+		with self.cond:
+			last = self.delivered
+			end = time.time() + timeout/1000.0
+			while self.delivered == last:
+				left = end - time.time()
+				if left <= 0:
+					return IS_TIMED_OUT
+				self.cond.wait(left)
+		return IS_SUCCESS
+
+	def is_FreezeVideo(self,hCam,wait):
+		self.Stop()
+		self.Expose()
+		return IS_SUCCESS
+
+	def is_CaptureVideo(self,hCam,wait):
+		self.Start()
+		return IS_SUCCESS
+
+	def is_StopLiveVideo(self,hCam,wait):
+		self.Stop()
+		return IS_SUCCESS
+
+	def is_SetImageSize(self,hCam,x,y):
+		return IS_SUCCESS
+
+	def is_SetImagePos(self,hCam,x,y):
+		with self.cond:
+			self.aoi[:2] = [x,y]
+		return IS_SUCCESS
+
+	def is_SetAOI(self,hCam,command,pX,pY,pWidth,pHeight):
+		if command == IS_SET_IMAGE_AOI:
+			with self.cond:
+				self.aoi = [pX[0],pY[0],pWidth[0],pHeight[0]]
+		else:
+			pX[0],pY[0],pWidth[0],pHeight[0] = self.aoi
+		return IS_SUCCESS
+
+	def is_SetColorMode(self,hCam,mode):
+		return IS_SUCCESS
+
+	def is_SetPixelClock(self,hCam,clock):
+		return IS_SUCCESS
+
+	def is_SetHardwareGain(self,hCam,master,red,green,blue):
+		return IS_SUCCESS
+
+	def is_SetGainBoost(self,hCam,mode):
+		return IS_SUCCESS
+
+	def is_SetGamma(self,hCam,gamma):
+		return IS_SUCCESS
+
+	def is_SetExposureTime(self,hCam,exposure,pNew):
+		if exposure > 0:
+			self.exposure = min(exposure,1000.0/self.fps)
+		pNew[0] = self.exposure
+		return IS_SUCCESS
+
+	def is_SetFrameRate(self,hCam,fps,pNew):
+		if fps > 0:
+			self.fps = fps
+			if self.maxFps:
+				# readout time goes with the number of rows
+				self.fps = min(fps,self.maxFps*self.height/float(self.aoi[3]))
+		pNew[0] = self.fps
+		return IS_SUCCESS
+
+	def is_SetSubSampling(self,hCam,mode):
+		return IS_SUCCESS
+
+
+class SimLibrary(object):
+	'''Stand-in for the uc480 dll, with one or more cameras attached.
+	Keyword arguments are passed on to each SimCamera.'''
+	def __init__(self,cameras=1,seed=0,**kwargs):
+		self.cameras = [SimCamera(seed=seed+i,serial='40020%05d' % (i+1),**kwargs)
+						for i in range(cameras)]
+		# open cameras by handle; handles are camera IDs, counting from 1
+		self.open = {}
+
+	def __getattr__(self,name):
+		'''Route per-camera calls to the SimCamera open on that handle'''
+		if not name.startswith('is_') or not hasattr(SimCamera,name):
+			raise AttributeError(name)
+		def call(hCam,*args):
+			cam = self.open.get(hCam)
+			if cam is None:
+				return IS_INVALID_CAMERA_HANDLE
+			return getattr(cam,name)(hCam,*args)
+		return call
+
+	def is_GetNumberOfCameras(self,pnNumCams):
+		pnNumCams[0] = len(self.cameras)
+		return IS_SUCCESS
+
+	def is_GetCameraList(self,pList):
+		count = ctypes.cast(pList,ctypes.POINTER(uc480.DWORD))[0]
+		if count < len(self.cameras):
+			# caller just asks how many there are
+			ctypes.cast(pList,ctypes.POINTER(uc480.DWORD))[0] = len(self.cameras)
+			return IS_SUCCESS
+		info = ctypes.cast(pList,ctypes.POINTER(uc480.UC480_CAMERA_LIST(count))).contents
+		info.dwCount = len(self.cameras)
+		for i,cam in enumerate(self.cameras):
+			info.uci[i].dwCameraID = i+1
+			info.uci[i].dwDeviceID = i+1
+			info.uci[i].dwInUse = (i+1) in self.open
+			info.uci[i].SerNo = cam.serial
+			info.uci[i].Model = 'SIM'
+		return IS_SUCCESS
+
+	def is_InitCamera(self,phCam,hWnd):
+		id = (phCam[0] or 0) & ~IS_USE_DEVICE_ID
+		if id == 0:
+			# first one that isn't open yet
+			free = [i+1 for i in range(len(self.cameras)) if (i+1) not in self.open]
+			if not free:
+				return IS_NO_SUCCESS
+			id = free[0]
+		if id > len(self.cameras) or id in self.open:
+			return IS_NO_SUCCESS
+		self.open[id] = self.cameras[id-1]
+		phCam[0] = id
+		return IS_SUCCESS
+
+	def is_ExitCamera(self,hCam):
+		cam = self.open.pop(hCam,None)
+		if cam is None:
+			return IS_INVALID_CAMERA_HANDLE
+		cam.Stop()
+		return IS_SUCCESS